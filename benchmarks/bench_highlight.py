@@ -0,0 +1,124 @@
+#!/usr/local/bin/python3
+
+# benchmark of the highlight engine against the original implementation (kept below as legacy_highlight)
+# texts are made of the usage passages in vocab.db: for every looked-up word, a "definition" is assembled
+# from passages of the same language, with the word's own passage first, and highlighted for card types A and B.
+# the engine has to return exactly the same text as the original function for every word.
+#
+import argparse
+import sqlite3
+import sys
+import time
+from os import path
+import regex as re
+
+sys.path.insert(0, path.join(path.dirname(path.realpath(__file__)), '..'))
+import kindle2anki as k
+
+def legacy_highlight(definition, word, card_type, lang): # highlight() as it was before the compiled engine, kept as reference
+    """
+    :param definition:     text response from the original lookup query to the mapped french language online dictionary 
+    :param word:           the word looked up in dictionary
+    :param card_type:      the selected card type determines replacemnt patterns
+    :param lang:           the language of the looked-up word (determines suffixes to be considered in pattern matching for highlighting)
+    :return definition:    the text with occurrences of word (including gramatically modified forms) hightlighted in bold-face
+    """
+    # we want to catch not only the looked up word verbatim but also grammatical variations 
+    # (e.g. as per number, gender or conjugation) that are frequent in many languages
+    # the following dictionary of suffix lists (one list per language), is unfortunately a 
+    # config item (though eventually a static one) hard coded in this function
+    patterns = [word]
+    s = {
+        'en': ['s', 'ed', 'er', 'ing', 'ly'],
+        'fr': ['s', 'e', 'es', 'er', 'eur', 'euse', 'aux', 'il', 'ille', 'eux', 'x','t', 'te', 'ent' , 'is' ,'it', 'ons', 'ont','ment'],
+        'es': ['s','o','a','os','as','ir','er','ar','í','ó','é','aron','se','ieron','amos','imos','emos','eis','ais','mente','aba'],
+        'pt': ['s','ir','er','ar','a','o','al','este','amos','emos','imos','ou','ei','i','ão','ões','aste','aram','eram','mente','ava'],
+        'de': ['e','st','er','s','t','d','en','ig','lich','ung','keit'],
+    }
+    suffixes = s[lang]
+    has_suffix = False
+    for s1 in suffixes:
+        # add patterns with suffix removed from word
+        if word.endswith(s1):
+            has_suffix = True
+            root = word[:-len(s1)]
+            patterns.append(root)
+            for s2 in suffixes:
+                if s2 == s1:
+                    continue
+                else:
+                    patterns.append(root + s2)
+    if has_suffix == False:
+        for s in suffixes:
+            patterns.append(word + s)    
+
+    # this is a special for the Portuguese Michaelis Dicitionary
+    # they include sillable separated spelling (like 'sel·va·gem')
+    # which would give away the word (would not be caught by the regex
+    # a few lines down (replacing the word by (...) unless we remove it 
+    if card_type == 'B':
+        definition = re.sub(r'(\b\w+·){1,}\w+\b',r'', definition)
+
+    # hightlight patterns, for card type 'B' replace the word by (...)
+    for pattern in patterns:
+        p = rf'(^|\s?)({pattern})(\s|\.|\,|:|\?|$)'
+        if card_type == 'A':
+            r = r'\1<b>\2</b>\3'
+        else:
+            r = r'\1<b>(...)</b>\3'
+        definition = re.sub(p, r, definition, flags=re.IGNORECASE)
+
+    return definition
+
+
+def load_samples(vdb, passages): # assemble (definition, word, lang) samples from the usage passages in vocab.db
+    """
+    :param vdb:         path to the vocab.db
+    :param passages:    number of passages of the same language making up one definition
+    :return samples:    list of (definition, word, lang) tuples
+    """
+    conn = sqlite3.connect(f'file:{vdb}?mode=ro', uri=True)
+    rows = conn.execute("SELECT word_key, usage FROM LOOKUPS ORDER BY id").fetchall()
+    conn.close()
+    by_lang = {}
+    for word_key, usage in rows:
+        lang, word = word_key.split(':', 1)
+        if lang in k.SUFFIXES and usage:
+            by_lang.setdefault(lang, []).append((word, usage))
+    samples = []
+    for lang, entries in by_lang.items():
+        for i, (word, usage) in enumerate(entries):
+            others = [entries[(i + j) % len(entries)][1] for j in range(1, passages)]
+            samples.append(('\n'.join([usage] + others), word, lang))
+    return samples
+
+def run(function, samples, card_type): # highlight all samples, return results and elapsed seconds
+    start = time.perf_counter()
+    results = [function(definition, word, card_type, lang) for definition, word, lang in samples]
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark highlight() against the original implementation")
+    parser.add_argument("-k", default=path.join(path.dirname(path.realpath(__file__)), '..', 'vocab.db'), help="Path to vocab.db", type=str)
+    parser.add_argument("-p", default=20, help="Passages per definition, default=20", type=int)
+    args = parser.parse_args()
+
+    samples = load_samples(args.k, args.p)
+    print(f"{len(samples)} samples, {sum(len(s[0]) for s in samples) // len(samples)} characters per definition on average")
+    failed = False
+    for card_type in ('A', 'B'):
+        k.highlight_patterns.cache_clear()
+        expected, t_legacy = run(legacy_highlight, samples, card_type)
+        actual, t_cold = run(k.highlight, samples, card_type)
+        _, t_warm = run(k.highlight, samples, card_type)
+        mismatches = sum(1 for a, b in zip(expected, actual) if a != b)
+        failed = failed or mismatches > 0
+        print(f"card type {card_type}: legacy {t_legacy:.3f}s, engine {t_cold:.3f}s (cold) {t_warm:.3f}s (memoized), "
+              f"speedup x{t_legacy / t_cold:.1f} (cold) x{t_legacy / t_warm:.1f} (memoized), {mismatches} mismatches")
+    single = sum(1 for _, word, lang in samples if len(k.highlight_patterns(word, lang)) == 1)
+    print(f"{single / len(samples):.0%} of words highlighted in a single pass")
+    if failed:
+        exit("highlight output differs from the original implementation")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/local/bin/python3
+
+# throughput benchmark of the lookup path (connect, fetch, redirect check, parse) against the local stand-in
+# for the dictionary sites (see standin.py). the looked-up words of the books of the dictionary's language in vocab.db
+# are looked up with each of the given worker counts; reported are words per second and the latency percentiles
+# of fetching a word (request including redirects and decoding).
+#
+import argparse
+import io
+import logging
+import sqlite3
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.realpath(__file__)), '..'))
+import kindle2anki as k
+import k2a_dictionaries as d
+import k2a_sessions as se
+from standin import StandIn, local_dictionary
+
+def load_words(vdb, lang, count): # looked-up words of a language with their stems
+    """
+    :param vdb:     path to vocab.db
+    :param lang:    language of the words
+    :param count:   number of words, padded with made-up words if vocab.db holds fewer
+    :return words, lemmas: list of words and dictionary mapping words to their stems
+    """
+    db = sqlite3.connect(vdb)
+    rows = db.execute("SELECT word, stem FROM WORDS WHERE lang = ? ORDER BY id", (lang,)).fetchall()
+    db.close()
+    lemmas = {}
+    for word, stem in rows:
+        lemmas.setdefault(word, stem or word)
+    words = list(lemmas)[:count]
+    words += [f'word{i}' for i in range(count - len(words))]
+    return words, lemmas
+
+def percentile(latencies, q): # q-th percentile in milliseconds
+    return statistics.quantiles(latencies, n=100, method='inclusive')[q - 1] * 1000 if len(latencies) > 1 else latencies[0] * 1000
+
+def run(dict, words, workers, per_host, parsers, rate): # look up words at the stand-in
+    """
+    :return seconds, latencies, found:  wall time, fetch latencies and number of definitions found
+    """
+    latencies = []
+    with redirect_stdout(io.StringIO()):
+        sessions = se.SessionPool(logging.WARNING, per_host)
+        session = sessions.session(dict['url'], dict['referer'])
+        sessions.wait()     # connections are warmed while the user picks book and dictionary
+        k.host_throttles.clear()   # every run starts at the full rate
+        fetch = k.make_fetch(session, dict, logging.WARNING, per_host, None, None, rate)
+
+        def timed(word):
+            start = time.perf_counter()
+            try:
+                return fetch(word)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        _, definitions = k.lookup_words(dict, words, timed, None, workers, parsers)
+        seconds = time.perf_counter() - start
+        sessions.close()
+    return seconds, latencies, sum(1 for definition in definitions.values() if definition != 'None')
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lookup path against the local dictionary stand-in")
+    parser.add_argument("-k", default=path.join(path.dirname(path.realpath(__file__)), '..', 'vocab.db'), help="Path to vocab.db", type=str)
+    parser.add_argument("--dict", default="fr:1", help="Dictionary as <lang>:<id>, default='fr:1'", type=str)
+    parser.add_argument("-n", default=200, help="Number of words looked up, default=200", type=int)
+    parser.add_argument("-w", default=[1, 4, 8, 16], nargs='+', help="Worker counts to compare, default=1 4 8 16", type=int)
+    parser.add_argument("-P", default=0, help="Number of parse processes, default=0", type=int)
+    parser.add_argument("--per-host", default=16, help="Maximum concurrent requests to the stand-in, default=16", type=int)
+    parser.add_argument("--latency", default=50, help="Milliseconds every response is delayed by, default=50", type=float)
+    parser.add_argument("--jitter", default=50, help="Further random delay of up to that many milliseconds, default=50", type=float)
+    parser.add_argument("--error-rate", default=0, help="Share of requests answered with 503, default=0", type=float)
+    parser.add_argument("--miss-rate", default=0.1, help="Share of words not found, default=0.1", type=float)
+    parser.add_argument("--no-redirect", action="store_true", help="Do not redirect Larousse lookups to the lemma")
+    parser.add_argument("--limit", default=None, help="Requests per second the stand-in tolerates (429 beyond), default=no limit", type=float)
+    parser.add_argument("--rate", default=1000, help="Maximum requests per second sent (see k2a_throttle), default=1000", type=float)
+    args = parser.parse_args()
+
+    lang, id = args.dict.split(':')
+    dict = next((dict for dict in d.get_dictionaries(lang) if dict['id'] == int(id)), None)
+    if dict is None:
+        exit(f"no dictionary {args.dict}")
+    words, lemmas = load_words(args.k, lang, args.n)
+
+    standin = StandIn(args.latency / 1000, args.jitter / 1000, args.error_rate, args.miss_rate, not args.no_redirect, lemmas, limit=args.limit)
+    if not any(route[1]['url'] == dict['url'] for route in standin.routes):
+        exit(f"no fixture page for {dict['url']} - the stand-in cannot serve it")
+    base = standin.start()
+    local = local_dictionary(dict, base)
+    print(f"{len(words)} words at {dict['url']} (stand-in: {args.latency:.0f}+{args.jitter:.0f} ms latency, "
+          f"{args.error_rate:.0%} errors, {args.miss_rate:.0%} not found)")
+    for workers in args.w:
+        standin.reset()
+        seconds, latencies, found = run(local, words, workers, args.per_host, args.P, args.rate)
+        print(f"workers {workers:3d}: {len(words) / seconds:8.1f} words/s, latency p50 {percentile(latencies, 50):6.1f} ms "
+              f"p90 {percentile(latencies, 90):6.1f} ms p99 {percentile(latencies, 99):6.1f} ms, {found} found, "
+              f"{standin.stats['requests']} requests ({standin.stats['redirects']} redirects, {standin.stats['errors']} errors, "
+              f"{standin.stats['throttled']} throttled)")
+    standin.stop()
+
+if __name__ == "__main__":
+    main()
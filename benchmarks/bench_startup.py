@@ -0,0 +1,69 @@
+#!/usr/local/bin/python3
+
+# cold-start benchmark: the wall time of importing kindle2anki and of running `kindle2anki.py -h` in a fresh
+# interpreter, and the modules kindle2anki imports at load time with their cumulative import time
+# (from python -X importtime). every run starts a new process, so the operating system's file cache is warm
+# but nothing is imported yet, as on every start of the program.
+#
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from os import path
+
+ROOT = path.join(path.dirname(path.realpath(__file__)), '..')
+
+def wall(command, runs): # median wall time of running command in a fresh process
+    """
+    :param command: list of arguments (the python interpreter is prepended)
+    :param runs:    number of runs
+    :return seconds:    median wall time
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def import_time(): # seconds of importing kindle2anki in a fresh interpreter
+    return wall(['-c', 'import kindle2anki'], 1)
+
+def help_time(): # seconds of `kindle2anki.py -h` in a fresh interpreter
+    return wall(['kindle2anki.py', '-h'], 1)
+
+def imported(module='kindle2anki'): # modules imported directly by module at load time
+    """
+    :return modules:    list of tuples (module, cumulative import time in seconds), slowest first
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                         capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in out.splitlines()[1:]:
+        _, cumulative, name = line.split('|')
+        # a module is listed after the modules it imports, those it imports itself are indented by one level;
+        # the modules listed before belong to other top-level imports (e.g. of site at interpreter start)
+        if not name.startswith('  '):
+            if name.strip() == module:
+                break
+            modules = []
+        elif not name.startswith('    '):
+            modules.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda item: -item[1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the start-up time of kindle2anki.py")
+    parser.add_argument("-r", default=10, help="Runs per measurement (the median counts), default=10", type=int)
+    parser.add_argument("-n", default=15, help="Number of imported modules listed, default=15", type=int)
+    args = parser.parse_args()
+
+    print(f"python -c 'import kindle2anki' {wall(['-c', 'pass'], args.r) * 1000:8.1f} ms for python alone, "
+          f"{wall(['-c', 'import kindle2anki'], args.r) * 1000:8.1f} ms with the import")
+    print(f"kindle2anki.py -h              {wall(['kindle2anki.py', '-h'], args.r) * 1000:8.1f} ms")
+    print("slowest modules imported at load time:")
+    for name, seconds in imported()[:args.n]:
+        print(f"  {name:32s} {seconds * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/local/bin/python3
+
+# microbenchmark suite: times the start-up of kindle2anki (see bench_startup), every parser on its fixture page in
+# benchmarks/fixtures, highlight() for card types A and B in every supported language, get_usage and the assembly
+# (create_cards) and writing (build_deck) of a deck.
+# words, passages and definitions come from a vocab.db generated with a fixed seed (see generate_vocab), so runs
+# are comparable. the results (best of several runs, in seconds) are written to a JSON report and compared with a
+# stored baseline: a benchmark slower than its baseline by more than the threshold counts as a regression.
+#
+import argparse
+import io
+import json
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.realpath(__file__)), '..'))
+import kindle2anki as k
+import k2a_dictionaries as d
+import k2a_response_parsers as p
+from check_parsers import load_fixtures
+from bench_startup import import_time, help_time
+import k2a_vocab as v
+
+HERE = path.dirname(path.realpath(__file__))
+
+# base forms per language, inflected with the suffixes highlight() knows (kindle2anki.SUFFIXES)
+STEMS = {
+    'en': ['walk', 'house', 'light', 'gloom', 'dark', 'open', 'sing', 'cold', 'tarry', 'forbear', 'wander', 'bright'],
+    'fr': ['maison', 'marche', 'parle', 'chant', 'ferme', 'lumière', 'sombre', 'froid', 'porte', 'tombe', 'peste', 'dalle'],
+    'es': ['casa', 'habla', 'canto', 'camino', 'luz', 'oscuro', 'frío', 'mira', 'toma', 'paso', 'zancudo', 'aletea'],
+    'pt': ['casa', 'fala', 'canto', 'anda', 'luz', 'escuro', 'frio', 'olha', 'toma', 'passo', 'selvagem', 'saudade'],
+    'de': ['Haus', 'geh', 'sprech', 'sing', 'Licht', 'dunkel', 'kalt', 'schau', 'nehm', 'Weg', 'Welt', 'gestern'],
+}
+
+def filler(rng, count): # made-up words
+    return [''.join(rng.choice('aeioulnrstmdc') for _ in range(rng.randint(2, 9))) for _ in range(count)]
+
+def generate_vocab(file, lookups=500, seed=0): # write a vocab.db with one book per supported language
+    """
+    :param file:    path of the vocab.db to be written
+    :param lookups: number of lookups per book
+    :param seed:    seed of the generated content
+    """
+    rng = random.Random(seed)
+    db = sqlite3.connect(file)
+    db.executescript("""
+        CREATE TABLE WORDS (id TEXT PRIMARY KEY NOT NULL, word TEXT, stem TEXT, lang TEXT, category INTEGER DEFAULT 0, timestamp INTEGER DEFAULT 0, profileid TEXT);
+        CREATE TABLE LOOKUPS (id TEXT PRIMARY KEY NOT NULL, word_key TEXT, book_key TEXT, dict_key TEXT, pos TEXT, usage TEXT, timestamp INTEGER DEFAULT 0);
+        CREATE INDEX lookupwordkey ON LOOKUPS (word_key);
+        CREATE INDEX lookupbookkey ON LOOKUPS (book_key);
+        CREATE TABLE BOOK_INFO (id TEXT PRIMARY KEY NOT NULL, asin TEXT, guid TEXT, lang TEXT, title TEXT, authors TEXT);
+    """)
+    timestamp = 1600000000000
+    for lang, stems in STEMS.items():
+        book = f'BENCH{lang.upper()}'
+        db.execute("INSERT INTO BOOK_INFO VALUES (?, ?, ?, ?, ?, ?)", (book, book, book, lang, f'Benchmark {lang}', 'k2a'))
+        for i in range(lookups):
+            # made-up base forms beyond the listed ones, so that most words are distinct
+            stem = rng.choice(stems) if i < len(stems) * 4 else rng.choice(stems) + filler(rng, 1)[0]
+            word = stem + rng.choice([''] + k.SUFFIXES[lang])
+            passage = filler(rng, rng.randint(8, 30))
+            passage.insert(rng.randrange(len(passage)), word)
+            timestamp += rng.randint(1000, 100000)
+            db.execute("INSERT OR IGNORE INTO WORDS VALUES (?, ?, ?, ?, 0, ?, '')", (f'{lang}:{word}', word, stem, lang, timestamp))
+            db.execute("INSERT INTO LOOKUPS VALUES (?, ?, ?, '', '', ?, ?)",
+                       (f'{book}:{i}', f'{lang}:{word}', book, ' '.join(passage).capitalize() + '.', timestamp))
+    db.commit()
+    db.close()
+
+def definitions(db, book, seed=0): # a definition for every looked-up word of a book, mentioning its forms
+    """
+    :return records:    records as yielded by iter_usage with 'title' and 'definition' added
+    """
+    rng = random.Random(seed)
+    records = list(k.iter_usage(db, book))
+    for record in records:
+        forms = [record['word'], record['stem'] or record['word']] + [record['word'] + suffix for suffix in k.SUFFIXES[book['lang']][:3]]
+        lines = []
+        for n in range(rng.randint(4, 12)):
+            sentence = filler(rng, rng.randint(10, 25))
+            for _ in range(rng.randint(0, 3)):
+                sentence.insert(rng.randrange(len(sentence)), rng.choice(forms))
+            lines.append(f'{n + 1}. ' + ' '.join(sentence))
+        record['title'] = record['word']
+        record['definition'] = '\n'.join(lines)
+    return records
+
+def measure(fn, repeat): # best wall time of fn over repeat runs
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def run(repeat, selected): # run the benchmarks whose names contain selected
+    """
+    :return results:    dictionary with benchmark names as keys and seconds as values
+    """
+    results = {}
+
+    def bench(name, fn):
+        if selected in name:
+            with redirect_stdout(io.StringIO()):
+                results[name] = measure(fn, repeat)
+
+    # cold start in a fresh interpreter (see bench_startup)
+    bench('startup/import', import_time)
+    bench('startup/help', help_time)
+
+    for name, fixture in load_fixtures().items():
+        parser = getattr(p, fixture['parser'])
+        bench(f'parse/{name}', lambda: parser(fixture['html'], fixture['word']))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vdb = path.join(tmp, 'vocab.db')
+        generate_vocab(vdb)
+        db = v.VocabDB(vdb)
+        books = sorted(k.get_books(db), key=lambda book: book['lang'])
+
+        for book in books:
+            records = definitions(db, book)
+            for card_type in ('A', 'B'):
+                def highlight():
+                    k.highlight_patterns.cache_clear()
+                    for record in records:
+                        k.highlight(record['definition'], record['word'], card_type, book['lang'], record['stem'])
+                bench(f"highlight/{book['lang']}/{card_type}", highlight)
+
+        bench('get_usage', lambda: [k.get_usage(db, book) for book in books])
+
+        book = next(book for book in books if book['lang'] == 'fr')
+        dict = d.get_dictionaries('fr')[0]
+        records = definitions(db, book)
+        bench('create_cards', lambda: k.create_cards(k.create_deck('bench.apkg', book, dict, 'A'), dict, 'A',
+                                                     [r['word'] for r in records], {r['word']: r['usage'] for r in records},
+                                                     {r['word']: r['title'] for r in records}, {r['word']: r['definition'] for r in records},
+                                                     {r['word']: r['stem'] for r in records}))
+        bench('build_deck', lambda: k.build_deck(path.join(tmp, 'bench.apkg'), dict, 'A', records, book))
+        db.close()
+    return results
+
+def compare(results, baseline, threshold): # compare results with the baseline
+    """
+    :return regressions:    names of the benchmarks slower than their baseline by more than threshold
+    """
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            print(f"{name:32s} {seconds * 1000:10.3f} ms")
+            continue
+        ratio = seconds / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:32s} {seconds * 1000:10.3f} ms  baseline {baseline[name] * 1000:10.3f} ms  x{ratio:5.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the microbenchmarks and compare them with a baseline")
+    parser.add_argument("-r", default=5, help="Runs per benchmark (the best counts), default=5", type=int)
+    parser.add_argument("-f", default='', help="Only run benchmarks whose name contains this, e.g. 'parse/'", type=str)
+    parser.add_argument("--report", default=path.join(HERE, 'report.json'), help="JSON report written, default=benchmarks/report.json", type=str)
+    parser.add_argument("--baseline", default=path.join(HERE, 'baseline.json'), help="JSON report compared with, default=benchmarks/baseline.json", type=str)
+    parser.add_argument("--threshold", default=0.25, help="Slowdown against the baseline counted as regression, default=0.25", type=float)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--lxml", action="store_true", help="Parse with lxml instead of html.parser (see kindle2anki.py --lxml)")
+    args = parser.parse_args()
+    if args.lxml:
+        p.set_backend('lxml')
+
+    results = run(args.r, args.f)
+    report = {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system(),
+                 'backend': p.backend, 'runs': args.r, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': results,
+    }
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"{len(results)} results stored as baseline in {args.baseline}")
+        return
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        # timings are only comparable on the same machine, interpreter and parse backend
+        differs = [key for key in ('python', 'machine', 'system', 'backend') if stored['meta'].get(key) != report['meta'][key]]
+        if differs:
+            print(f"baseline {args.baseline} was taken with another {', '.join(differs)} - timings may not be comparable")
+    except FileNotFoundError:
+        baseline = {}
+        print(f"no baseline at {args.baseline} - run with --save-baseline to store one")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        exit(f"{len(regressions)} regressions beyond {args.threshold:.0%}: " + ', '.join(regressions))
+
+if __name__ == "__main__":
+    main()
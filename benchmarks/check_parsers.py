@@ -0,0 +1,54 @@
+#!/usr/local/bin/python3
+
+# check the parsers in k2a_response_parsers against the fixtures in benchmarks/fixtures (synthetic pages in the
+# markup of the dictionary sites):
+# every fixture page is parsed with each available backend and compared with the output recorded
+# for it (<fixture>.expected.txt). fixtures.json maps each page to its parser and looked-up word.
+#
+import json
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.realpath(__file__)), '..'))
+import k2a_response_parsers as p
+
+FIXTURES = path.join(path.dirname(path.realpath(__file__)), 'fixtures')
+
+def load_fixtures(): # read the fixture pages together with parser, word and expected output
+    """
+    :return fixtures:   dictionary with fixture names as keys and dicts with 'parser', 'word', 'url', 'html' and 'expected' as values
+    """
+    with open(path.join(FIXTURES, 'fixtures.json'), encoding='utf-8') as f:
+        fixtures = json.load(f)
+    for name, fixture in fixtures.items():
+        with open(path.join(FIXTURES, f'{name}.html'), encoding='utf-8') as f:
+            fixture['html'] = f.read()
+        with open(path.join(FIXTURES, f'{name}.expected.txt'), encoding='utf-8', newline='') as f:
+            fixture['expected'] = f.read()
+    return fixtures
+
+def main():
+    fixtures = load_fixtures()
+    backends = ['html.parser']
+    try:
+        import lxml
+        backends.append('lxml')
+    except ImportError:
+        print("lxml not installed - checking html.parser only")
+
+    default = p.backend
+    failed = []
+    for backend in backends:
+        p.set_backend(backend)
+        for name, fixture in fixtures.items():
+            parsed = getattr(p, fixture['parser'])(fixture['html'], fixture['word'])
+            if parsed != fixture['expected']:
+                failed.append(f'{backend}: {name}')
+    p.set_backend(default)
+
+    print(f"{len(fixtures)} fixtures checked with {', '.join(backends)}")
+    if failed:
+        exit('output differs from the expected output for ' + ', '.join(failed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/local/bin/python3
+
+# local stand-in for the online dictionaries, to benchmark the lookup path without touching the live sites.
+# every dictionary configured in k2a_dictionaries is served at http://127.0.0.1:<port>/<host>/<path>
+# (see local_dictionary) with the synthetic fixture pages in benchmarks/fixtures: the page made for its parser,
+# or its miss page for words chosen not to be found. RAE is looked up through pyrae and cannot be served here.
+# latency, an error rate, a request rate limit (answered with 429 and Retry-After beyond it), the share of words
+# not found and Larousse's redirect to the lemma
+# (.../<word> -> .../<lemma>/<id>) can be injected; with an archive (see k2a_archive) recorded responses
+# of the looked-up words are replayed instead of the fixtures.
+#
+import argparse
+import collections
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from urllib.parse import quote, unquote, urlsplit
+
+sys.path.insert(0, path.join(path.dirname(path.realpath(__file__)), '..'))
+import k2a_dictionaries as d
+import k2a_response_parsers as p
+import k2a_archive as ar
+from check_parsers import load_fixtures
+
+LANGS = ['en', 'fr', 'es', 'pt', 'de']
+NOT_FOUND = '<html><head><title>not found</title></head><body><p>no results</p></body></html>'
+
+def routes(fixtures): # map the url paths of all configured dictionaries to the pages served for them
+    """
+    :param fixtures:    the fixtures as read by load_fixtures
+    :return routes:     list of tuples (path prefix '/<host>/<path>', dictionary, page for found words, page for words
+                        not found), longest prefix first; dictionaries without a fixture page for their parser are left out
+    """
+    routes = []
+    for lang in LANGS:
+        for dict in d.get_dictionaries(lang):
+            if dict['url'] == 'https://dle.rae.es/':
+                continue
+            parser = getattr(p, f"parse_{dict['src_lang']}_{dict['id']}", None)
+            # aliased parsers (e.g. all Larousse bi-lingual dictionaries) share their pages
+            pages = [fixture for fixture in fixtures.values() if getattr(p, fixture['parser']) is parser]
+            hit = next((fixture['html'] for fixture in pages if fixture['expected'] != 'None'), None)
+            if hit is None:
+                continue
+            miss = next((fixture['html'] for fixture in pages if fixture['expected'] == 'None'), NOT_FOUND)
+            url = urlsplit(dict['url'])
+            routes.append(('/' + url.netloc + url.path, dict, hit, miss))
+    return sorted(routes, key=lambda route: len(route[0]), reverse=True)
+
+def local_dictionary(dict, base): # the dictionary as served by the stand-in
+    """
+    :param dict:    a dictionary (data type) as configured in k2a_dictionaries
+    :param base:    base url of the running stand-in (see StandIn.start)
+    :return dict:   a copy of dict with url and referer pointing to the stand-in
+    """
+    url = urlsplit(dict['url'])
+    return {**dict, 'url': base + '/' + url.netloc + url.path, 'referer': base + '/' + url.netloc}
+
+class StandIn:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, miss_rate=0.0, redirect=True, lemmas=None, archive=None, seed=0, limit=None):
+        """
+        :param latency:     seconds every response is delayed by
+        :param jitter:      further random delay of up to that many seconds
+        :param error_rate:  share of requests answered with 503
+        :param miss_rate:   share of words not found (the same words on every run)
+        :param redirect:    redirect Larousse lookups to .../<lemma>/<id> as the site does
+        :param lemmas:      optional dictionary mapping words to their lemma (e.g. the stems in vocab.db) for the redirects
+        :param archive:     optional path to a response archive, archived responses are replayed for the words in it
+        :param seed:        seed for the random delays and errors
+        :param limit:       optional number of requests per second tolerated, further requests are answered with 429
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.miss_rate = miss_rate
+        self.redirect = redirect
+        self.lemmas = lemmas or {}
+        self.archive = ar.ResponseArchive(archive) if archive else None
+        self.random = random.Random(seed)
+        self.limit = limit
+        self.recent = collections.deque()     # times of the requests within the last second
+        self.lock = threading.Lock()
+        self.routes = routes(load_fixtures())
+        self.server = None
+        self.reset()
+
+    def reset(self): # reset the request counters
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0, 'redirects': 0, 'misses': 0, 'replayed': 0}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def respond(self, request): # answer one GET request of the handler
+        """
+        :param request:     the BaseHTTPRequestHandler of the request
+        :return response:   tuple (status, headers, body)
+        """
+        self.count('requests')
+        if self.limit:
+            with self.lock:
+                now = time.monotonic()
+                while self.recent and now - self.recent[0] > 1.0:
+                    self.recent.popleft()
+                throttled = len(self.recent) >= self.limit
+                if not throttled:
+                    self.recent.append(now)
+            if throttled:
+                self.count('throttled')
+                return 429, {'Retry-After': '1'}, 'too many requests'
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            error = self.random.random() < self.error_rate
+        time.sleep(delay)
+        if error:
+            self.count('errors')
+            return 503, {}, 'service unavailable'
+
+        route = next((route for route in self.routes if request.path.startswith(route[0])), None)
+        if route is None:
+            return 404, {}, NOT_FOUND
+        prefix, dict, hit, miss = route
+        rest = request.path[len(prefix):].split('?')[0]
+        if not rest:
+            return 200, {}, '<html><body>stand-in for ' + dict['url'] + '</body></html>'
+        segments = rest.split('/')
+        word = unquote(segments[0])
+        if word.endswith('.html'):
+            word = word[:-len('.html')]
+
+        # Larousse redirects a word to the entry of its lemma, the entry id following the lemma
+        if self.redirect and 'larousse' in prefix and (len(segments) < 2 or not segments[1]):
+            self.count('redirects')
+            lemma = self.lemmas.get(word) or word
+            return 302, {'Location': prefix + quote(lemma) + '/' + str(zlib.crc32(lemma.encode('utf-8')) % 100000)}, ''
+
+        if self.archive:
+            entry = self.archive.get(dict, word)
+            if entry:
+                self.count('replayed')
+                return 200, {}, entry[1]
+        if zlib.crc32(word.encode('utf-8')) % 1000 < self.miss_rate * 1000:
+            self.count('misses')
+            return 200, {}, miss
+        return 200, {}, hit
+
+    def start(self, port=0): # serve in a background thread
+        """
+        :param port:    port to listen on, 0 for any free port
+        :return base:   base url of the stand-in
+        """
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # keep-alive, as the live sites
+
+            def do_GET(self):
+                status, headers, body = standin.respond(self)
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.archive:
+            self.archive.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the fixture pages of the dictionaries locally")
+    parser.add_argument("--port", default=8080, help="Port to listen on, default=8080", type=int)
+    parser.add_argument("--latency", default=0, help="Milliseconds every response is delayed by, default=0", type=float)
+    parser.add_argument("--jitter", default=0, help="Further random delay of up to that many milliseconds, default=0", type=float)
+    parser.add_argument("--error-rate", default=0, help="Share of requests answered with 503, default=0", type=float)
+    parser.add_argument("--miss-rate", default=0, help="Share of words not found, default=0", type=float)
+    parser.add_argument("--limit", default=None, help="Requests per second tolerated, default=no limit", type=float)
+    parser.add_argument("--no-redirect", action="store_true", help="Do not redirect Larousse lookups to the lemma")
+    parser.add_argument("-a", default=None, help="Response archive to replay recorded responses from", type=str)
+    args = parser.parse_args()
+
+    standin = StandIn(args.latency / 1000, args.jitter / 1000, args.error_rate, args.miss_rate, not args.no_redirect, archive=args.a, limit=args.limit)
+    base = standin.start(args.port)
+    for prefix, dict, _, _ in reversed(standin.routes):
+        print(f"{dict['src_lang']} {dict['id']}: {dict['url']} -> {base}{prefix}")
+    print("serving, press Ctrl-C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        standin.stop()
+
+if __name__ == "__main__":
+    main()
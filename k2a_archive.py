@@ -0,0 +1,129 @@
+# opt-in archive of the raw dictionary responses, kept in a local sqlite file
+# so that definitions can be parsed again (e.g. after a parser was fixed) without fetching anything.
+# response bodies are stored content-addressed (sha256 of the body) and zlib-compressed with a preset
+# dictionary per site: pages of one site share most of their markup, which the first archived page
+# of the site provides to all later ones.
+# lookups (dictionary and word) map to the body and the final url after redirects.
+#
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+from k2a_cache import normalize
+
+ZDICT_SIZE = 32 * 1024      # zlib uses at most a 32 KB window, a larger preset dictionary would not help
+
+class ResponseArchive:
+    def __init__(self, path):
+        """
+        :param path:    path to the sqlite file holding the archive (created if missing)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.zdicts = {}        # site -> preset dictionary, read once per site
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS sites (
+                site TEXT PRIMARY KEY NOT NULL,
+                zdict BLOB NOT NULL
+            )""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS bodies (
+                digest TEXT PRIMARY KEY NOT NULL,
+                site TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                src_lang TEXT NOT NULL,
+                dict_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                word TEXT NOT NULL,
+                final_url TEXT NOT NULL,
+                encoding TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                fetched REAL NOT NULL,
+                PRIMARY KEY (src_lang, dict_id, url, word)
+            )""")
+
+    def zdict(self, site, content=None): # get the preset dictionary of a site, derived from content if the site is new
+        """
+        :param site:        host name of the dictionary site
+        :param content:     body of a page of the site (bytes), None to only read an existing dictionary
+        :return zdict:      the preset dictionary (bytes), None if the site has none and no content was given
+        """
+        if site not in self.zdicts:
+            row = self.db.execute("SELECT zdict FROM sites WHERE site = ?", (site,)).fetchone()
+            if row:
+                self.zdicts[site] = row[0]
+            elif content is not None:
+                # head and tail of a page hold the markup all pages of a site share (header, menus, footer)
+                half = ZDICT_SIZE // 2
+                zdict = content if len(content) <= ZDICT_SIZE else content[:half] + content[-half:]
+                # another process archiving the same site may have stored its dictionary meanwhile: the first one stored
+                # is used by all
+                self.db.execute("INSERT OR IGNORE INTO sites (site, zdict) VALUES (?, ?)", (site, zdict))
+                self.zdicts[site] = self.db.execute("SELECT zdict FROM sites WHERE site = ?", (site,)).fetchone()[0]
+            else:
+                return None
+        return self.zdicts[site]
+
+    def put(self, dict, word, final_url, content, encoding): # archive the response to a lookup
+        """
+        :param dict:        the (online language) dictionary the word was looked up in
+        :param word:        the looked-up word
+        :param final_url:   the url of the response after redirects
+        :param content:     the response body (bytes)
+        :param encoding:    the encoding the body is decoded with
+        """
+        key = (dict['src_lang'], dict['id'], dict['url'], normalize(word))
+        site = urlsplit(dict['url']).netloc
+        digest = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            zdict = self.zdict(site, content)
+            if not self.db.execute("SELECT 1 FROM bodies WHERE digest = ?", (digest,)).fetchone():
+                compressor = zlib.compressobj(9, zdict=zdict)
+                body = compressor.compress(content) + compressor.flush()
+                self.db.execute("INSERT INTO bodies (digest, site, body, size) VALUES (?, ?, ?, ?)",
+                                (digest, site, body, len(content)))
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (src_lang, dict_id, url, word, final_url, encoding, digest, fetched) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, final_url, encoding, digest, time.time()))
+
+    def get(self, dict, word): # read the archived response to a lookup
+        """
+        :param dict:    the (online language) dictionary the word was looked up in
+        :param word:    the looked-up word
+        :return entry:  tuple (final url, response text) or None if the lookup was not archived
+        """
+        key = (dict['src_lang'], dict['id'], dict['url'], normalize(word))
+        with self.lock:
+            row = self.db.execute(
+                "SELECT r.final_url, r.encoding, b.site, b.body FROM responses r JOIN bodies b ON b.digest = r.digest "
+                "WHERE r.src_lang = ? AND r.dict_id = ? AND r.url = ? AND r.word = ?", key).fetchone()
+            if row is None:
+                return None
+            final_url, encoding, site, body = row
+            zdict = self.zdict(site)
+        decompressor = zlib.decompressobj(zdict=zdict)
+        content = decompressor.decompress(body) + decompressor.flush()
+        return final_url, content.decode(encoding, errors='replace')
+
+    def stats(self): # sizes of the archive
+        """
+        :return stats:  tuple (number of archived lookups, number of distinct bodies, raw size, compressed size)
+        """
+        with self.lock:
+            lookups = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            bodies, size, stored = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(body)), 0) FROM bodies").fetchone()
+        return lookups, bodies, size, stored
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,255 @@
+# persistent on-disk cache for dictionary lookups, kept in a local sqlite file
+# so that rebuilding a deck does not refetch and reparse every word.
+# entries are keyed by dictionary (src_lang, id, url) and normalized word and expire after a TTL;
+# the cache is trimmed to a maximum size by evicting the least recently used entries.
+# words a dictionary does not contain are kept apart as misses with a TTL of their own, stored compactly
+# as 64 bit hashes of dictionary and word in a table clustered on them (a sorted key file within the cache file).
+# a lookup redirected to the entry of another word (e.g. Larousse redirects inflected forms to their lemma)
+# is stored under that word, with an alias from the looked-up word: the entry serves both, and any other word
+# of the same entry once its alias is known.
+# the file may be shared by several processes (WAL journal, busy timeout) and by several threads
+# of one process (one connection guarded by a lock).
+# the same file also keeps the book catalog of a vocab.db, valid as long as that file is unchanged,
+# and the encoding detected per dictionary for responses that do not declare one (detected again after the TTL).
+#
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+DEFAULT_TTL = 30 * 24 * 3600            # 30 days
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024     # 64 MB of cached definitions
+DEFAULT_MISS_TTL = 7 * 24 * 3600        # 7 days
+
+def normalize(word): # normalize a word for use in cache keys
+    """
+    :param word:    the looked-up word
+    :return word:   the word NFC-normalized and lower-cased (lookup URLs are built from the lower-cased word too)
+    """
+    return unicodedata.normalize('NFC', word).strip().lower()
+
+def key_hash(*parts): # 64 bit hash of a key, as stored in the misses table
+    """
+    :param parts:   the parts of the key (strings or numbers)
+    :return hash:   signed 64 bit integer (sqlite INTEGER)
+    """
+    digest = hashlib.blake2b('\x1f'.join(str(part) for part in parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+class DefinitionCache:
+    def __init__(self, path, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, miss_ttl=DEFAULT_MISS_TTL):
+        """
+        :param path:        path to the sqlite file holding the cache (created if missing)
+        :param ttl:         time to live of an entry (and of a detected encoding) in seconds
+        :param max_size:    maximum summed size of cached definitions in bytes, least recently used entries are evicted beyond that
+        :param miss_ttl:    time to live of a miss (word not found in a dictionary) in seconds
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.miss_ttl = miss_ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS definitions (
+                src_lang TEXT NOT NULL,
+                dict_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                word TEXT NOT NULL,
+                title TEXT,
+                definition TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (src_lang, dict_id, url, word)
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS definitions_accessed ON definitions (accessed)")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS aliases (
+                src_lang TEXT NOT NULL,
+                dict_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                word TEXT NOT NULL,
+                lemma TEXT NOT NULL,
+                PRIMARY KEY (src_lang, dict_id, url, word)
+            )""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS catalogs (
+                vdb TEXT PRIMARY KEY NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                books TEXT NOT NULL
+            )""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS misses (
+                dict INTEGER NOT NULL,
+                word INTEGER NOT NULL,
+                created INTEGER NOT NULL,
+                PRIMARY KEY (dict, word)
+            ) WITHOUT ROWID""")
+        # encodings detected by earlier versions never expired: they are detected afresh
+        self.db.execute("DROP TABLE IF EXISTS encodings")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS detected_encodings (
+                src_lang TEXT NOT NULL,
+                dict_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                encoding TEXT NOT NULL,
+                detected REAL NOT NULL,
+                PRIMARY KEY (src_lang, dict_id, url)
+            )""")
+
+    def get(self, dict, word): # look up a cached definition
+        """
+        :param dict:    the (online language) dictionary the word was looked up in
+        :param word:    the looked-up word
+        :return entry:  tuple (title, definition) or None if the word is not cached or the entry has expired
+        """
+        key = (dict['src_lang'], dict['id'], dict['url'], normalize(word))
+        now = time.time()
+        with self.lock:
+            # words known to redirect are served the entry they redirect to
+            alias = self.db.execute("SELECT lemma FROM aliases WHERE src_lang = ? AND dict_id = ? AND url = ? AND word = ?",
+                                    key).fetchone()
+            if alias:
+                key = (*key[:3], alias[0])
+            row = self.db.execute(
+                "SELECT title, definition, created FROM definitions WHERE src_lang = ? AND dict_id = ? AND url = ? AND word = ?",
+                key).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.ttl:
+                self.db.execute("DELETE FROM definitions WHERE src_lang = ? AND dict_id = ? AND url = ? AND word = ?", key)
+                return None
+            self.db.execute(
+                "UPDATE definitions SET accessed = ? WHERE src_lang = ? AND dict_id = ? AND url = ? AND word = ?",
+                (now, *key))
+        return row[0], row[1]
+
+    def put(self, dict, word, title, definition): # store a parsed definition
+        """
+        :param dict:        the (online language) dictionary the word was looked up in
+        :param word:        the looked-up word
+        :param title:       the redirect title determined by check_redirect, the entry is stored under it
+                            (with an alias from word) if the lookup was redirected to another word
+        :param definition:  the parsed definition
+        """
+        key = (dict['src_lang'], dict['id'], dict['url'], normalize(word))
+        now = time.time()
+        size = len(definition.encode('utf-8'))
+        with self.lock:
+            lemma = normalize(title) if title else key[3]
+            if lemma != key[3]:
+                self.db.execute("INSERT OR REPLACE INTO aliases (src_lang, dict_id, url, word, lemma) VALUES (?, ?, ?, ?, ?)",
+                                (*key, lemma))
+                key = (*key[:3], lemma)
+            else:
+                self.db.execute("DELETE FROM aliases WHERE src_lang = ? AND dict_id = ? AND url = ? AND word = ?", key)
+            self.db.execute(
+                "INSERT OR REPLACE INTO definitions (src_lang, dict_id, url, word, title, definition, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, title, definition, size, now, now))
+            self.db.execute("DELETE FROM misses WHERE dict = ? AND word = ?", self.miss_key(dict, word))
+
+    def miss_key(self, dict, word): # key of a word in the misses table
+        return key_hash(dict['src_lang'], dict['id'], dict['url']), key_hash(normalize(word))
+
+    def is_miss(self, dict, word): # check whether a word is known not to be found in a dictionary
+        """
+        :param dict:    the (online language) dictionary
+        :param word:    the looked-up word
+        :return miss:   True if the word was not found in the dictionary within the miss TTL
+        """
+        with self.lock:
+            row = self.db.execute("SELECT created FROM misses WHERE dict = ? AND word = ?", self.miss_key(dict, word)).fetchone()
+        return row is not None and time.time() - row[0] <= self.miss_ttl
+
+    def put_miss(self, dict, word): # record that a word was not found in a dictionary
+        """
+        :param dict:    the (online language) dictionary
+        :param word:    the looked-up word
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO misses (dict, word, created) VALUES (?, ?, ?)",
+                            (*self.miss_key(dict, word), int(time.time())))
+
+    def evict(self): # drop expired entries and trim the cache to max_size (least recently used first)
+        """
+        :return count:  number of entries removed
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                count = self.db.execute("DELETE FROM definitions WHERE created < ?", (time.time() - self.ttl,)).rowcount
+                count += self.db.execute("DELETE FROM misses WHERE created < ?", (int(time.time() - self.miss_ttl),)).rowcount
+                self.db.execute("DELETE FROM detected_encodings WHERE detected < ?", (time.time() - self.ttl,))
+                total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM definitions").fetchone()[0]
+                if total > self.max_size:
+                    excess = total - self.max_size
+                    victims = []
+                    for rowid, size in self.db.execute("SELECT rowid, size FROM definitions ORDER BY accessed"):
+                        if excess <= 0:
+                            break
+                        victims.append((rowid,))
+                        excess -= size
+                    self.db.executemany("DELETE FROM definitions WHERE rowid = ?", victims)
+                    count += len(victims)
+                # aliases of evicted entries are learned again with the next lookup
+                self.db.execute("""
+                    DELETE FROM aliases WHERE NOT EXISTS (
+                        SELECT 1 FROM definitions d WHERE d.src_lang = aliases.src_lang AND d.dict_id = aliases.dict_id
+                                                      AND d.url = aliases.url AND d.word = aliases.lemma)""")
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return count
+
+    def get_catalog(self, vdb): # get the cached book catalog of a vocab.db
+        """
+        :param vdb:     path to the vocab.db
+        :return books:  list of books as stored by put_catalog, None if not cached or vocab.db changed since
+        """
+        stat = os.stat(vdb)
+        with self.lock:
+            row = self.db.execute("SELECT books FROM catalogs WHERE vdb = ? AND mtime = ? AND size = ?",
+                                  (os.path.realpath(vdb), stat.st_mtime_ns, stat.st_size)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_catalog(self, vdb, books): # store the book catalog of a vocab.db
+        """
+        :param vdb:     path to the vocab.db
+        :param books:   list of books (dicts of JSON serializable values)
+        """
+        stat = os.stat(vdb)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO catalogs (vdb, mtime, size, books) VALUES (?, ?, ?, ?)",
+                            (os.path.realpath(vdb), stat.st_mtime_ns, stat.st_size, json.dumps(books)))
+
+    def get_encoding(self, dict): # get the encoding detected for responses of a dictionary
+        """
+        :param dict:        the (online language) dictionary
+        :return encoding:   the encoding stored by put_encoding, None if none was detected yet or it expired
+        """
+        with self.lock:
+            row = self.db.execute("SELECT encoding FROM detected_encodings WHERE src_lang = ? AND dict_id = ? AND url = ? "
+                                  "AND detected >= ?", (dict['src_lang'], dict['id'], dict['url'], time.time() - self.ttl)).fetchone()
+        return row[0] if row else None
+
+    def put_encoding(self, dict, encoding): # store the encoding detected for responses of a dictionary
+        """
+        :param dict:        the (online language) dictionary
+        :param encoding:    the detected encoding
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO detected_encodings (src_lang, dict_id, url, encoding, detected) "
+                            "VALUES (?, ?, ?, ?, ?)", (dict['src_lang'], dict['id'], dict['url'], encoding, time.time()))
+
+    def close(self):
+        self.evict()
+        self.db.close()
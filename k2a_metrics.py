@@ -0,0 +1,186 @@
+# optional instrumentation of a run (--metrics): time spent and calls per stage (vocab.db queries, http requests,
+# decoding, parsing per parser function, the definition cache, highlighting, note creation and writing the deck),
+# latency histograms (per http request and per looked-up word), cache hits and bytes transferred, written to a
+# JSON report when the program exits; optionally a cProfile dump of the main and the lookup threads (--profile).
+# recording is off unless started and then costs next to nothing. processes (parse processes, the processes
+# writing the decks of a batch) record into a recorder of their own that is merged into the run's (see collect).
+# stages run concurrently in several threads, their seconds add up the time of all threads.
+#
+import atexit
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+OFF = nullcontext()
+
+class Timer: # context manager adding the time spent in its block to a stage
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.stage, time.perf_counter() - self.start)
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.profiles = None    # cProfile.Profile per profiled thread, None unless profiling
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self): # forget everything recorded so far
+        self.stages = {}        # stage -> [calls, seconds]
+        self.counters = {}      # name -> count
+        self.latencies = {}     # name -> list of seconds
+        self.started = time.time()
+        self.clock = time.perf_counter()
+
+    def timed(self, stage): # context manager timing its block as stage, a no-op unless recording
+        return Timer(self, stage) if self.enabled else OFF
+
+    def add(self, stage, seconds, calls=1): # add time spent to a stage
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+
+    def count(self, name, n=1): # add to a counter
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds): # record a latency for the histogram name
+        if self.enabled:
+            with self.lock:
+                self.latencies.setdefault(name, []).append(seconds)
+
+    def snapshot(self): # everything recorded, as plain (picklable) data
+        with self.lock:
+            return {'stages': {stage: list(entry) for stage, entry in self.stages.items()},
+                    'counters': dict(self.counters),
+                    'latencies': {name: list(values) for name, values in self.latencies.items()}}
+
+    def merge(self, snapshot): # add what another recorder (e.g. of a process) recorded
+        with self.lock:
+            for stage, (calls, seconds) in snapshot['stages'].items():
+                entry = self.stages.setdefault(stage, [0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, values in snapshot['latencies'].items():
+                self.latencies.setdefault(name, []).extend(values)
+
+    def report(self, meta=None): # the JSON report of the run
+        """
+        :param meta:    optional dictionary describing the run (e.g. the command line)
+        :return report: dictionary with 'meta', 'stages' (calls, seconds and mean per stage, slowest first),
+                        'latencies' (count, percentiles and histogram in milliseconds per histogram),
+                        'cache' (hits and hit rate), 'http' (requests and bytes), 'archive' (size of the response
+                        archive, if one was kept) and all raw 'counters'
+        """
+        import statistics
+        snapshot = self.snapshot()
+        wall = time.perf_counter() - self.clock
+        counters = snapshot['counters']
+        stages = {stage: {'calls': calls, 'seconds': round(seconds, 6), 'mean_ms': round(seconds / calls * 1000, 3)}
+                  for stage, (calls, seconds) in sorted(snapshot['stages'].items(), key=lambda item: -item[1][1])}
+        latencies = {}
+        for name, values in snapshot['latencies'].items():
+            values.sort()
+            quantiles = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+            histogram = {f'<={bound * 1000:g}ms': 0 for bound in BUCKETS}
+            histogram[f'>{BUCKETS[-1] * 1000:g}ms'] = 0
+            for value in values:
+                bucket = next((f'<={bound * 1000:g}ms' for bound in BUCKETS if value <= bound), f'>{BUCKETS[-1] * 1000:g}ms')
+                histogram[bucket] += 1
+            latencies[name] = {'count': len(values), 'mean_ms': round(statistics.fmean(values) * 1000, 3),
+                               'p50_ms': round(quantiles[49] * 1000, 3), 'p90_ms': round(quantiles[89] * 1000, 3),
+                               'p99_ms': round(quantiles[98] * 1000, 3), 'max_ms': round(values[-1] * 1000, 3),
+                               'histogram': histogram}
+        archive = None
+        if 'archive/lookups' in counters:
+            size, stored = counters.get('archive/bytes', 0), counters.get('archive/stored_bytes', 0)
+            archive = {'lookups': counters['archive/lookups'], 'bodies': counters.get('archive/bodies', 0),
+                       'bytes': size, 'stored_bytes': stored, 'ratio': round(size / stored, 2) if stored else None}
+        served = counters.get('cache/hits', 0) + counters.get('cache/known_misses', 0)
+        looked_up = served + counters.get('cache/lookups', 0)
+        return {
+            'meta': {**(meta or {}), 'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                     'wall_seconds': round(wall, 3)},
+            'stages': stages,
+            'latencies': latencies,
+            'cache': {'hits': counters.get('cache/hits', 0), 'known_misses': counters.get('cache/known_misses', 0),
+                      'lookups': counters.get('cache/lookups', 0), 'hit_rate': round(served / looked_up, 4) if looked_up else None},
+            'http': {'requests': counters.get('http/requests', 0), 'throttled': counters.get('http/throttled', 0),
+                     'errors': counters.get('http/errors', 0), 'bytes': counters.get('http/bytes', 0),
+                     'wire_bytes': counters.get('http/wire_bytes', 0)},
+            'archive': archive,
+            'counters': dict(sorted(counters.items())),
+        }
+
+    def write(self, file, meta=None): # write the JSON report
+        with open(file, 'w', encoding='utf-8') as f:
+            json.dump(self.report(meta), f, indent=2)
+
+    def profile_thread(self): # profile the calling thread, if profiling (e.g. as initializer of a thread pool)
+        if self.profiles is not None:
+            import cProfile
+            profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+            profile.enable()
+
+    def dump_profile(self, file): # write the profiles of all profiled threads, combined, in pstats format
+        import pstats
+        stats = None
+        for profile in self.profiles:
+            profile.disable()
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        stats.dump_stats(file)
+
+metrics = Metrics()     # the recorder of the run, shared by all modules
+
+def collect(fn, *args): # run fn in a process recording on its own (see Metrics.merge)
+    """
+    :return result, snapshot:   what fn returned and what was recorded while it ran
+    """
+    metrics.reset()
+    metrics.enabled = True
+    return fn(*args), metrics.snapshot()
+
+def start(report=None, profile=None, meta=None): # record the run, report and profile are written when the program exits
+    """
+    :param report:  path of the JSON report, None to record nothing
+    :param profile: path of the cProfile dump, None not to profile
+    :param meta:    optional dictionary describing the run, included in the report
+    """
+    if report:
+        metrics.reset()
+        metrics.enabled = True
+    if profile:
+        metrics.profiles = []
+        metrics.profile_thread()
+
+    # written however the program ends (including exit() and Ctrl-C)
+    def finish():
+        if profile:
+            metrics.dump_profile(profile)
+            print(f"profile written to {profile} (python -m pstats {profile})")
+        if report:
+            metrics.write(report, meta)
+            print(f"metrics written to {report}")
+
+    atexit.register(finish)
@@ -1,4 +1,4 @@
-from bs4 import BeautifulSoup as bs
+from bs4 import BeautifulSoup as bs, SoupStrainer
 import unicodedata
 import regex as re
 # each parser function defined maps to a specific online dictionary
@@ -6,6 +6,33 @@ import regex as re
 # e.g. function 'parse_en_1' maps to the first (id '1') English (lang 'en') dictionary defined.
 # The available dictionaries are defined within the kindle2anki.getDictioaries() function
 # 
+# the tree builder used for parsing responses: python's html.parser by default; lxml is much faster and can be
+# chosen instead (--lxml, see set_backend) but has only been checked against the synthetic fixture pages in
+# benchmarks/fixtures, not against pages captured from the dictionary sites
+backend = 'html.parser'
+
+def set_backend(name): # choose the tree builder used by the parsers
+    """
+    :param name:    'lxml' or 'html.parser'
+    """
+    global backend
+    if name not in ('lxml', 'html.parser'):
+        raise ValueError(f"Invalid parse backend: {name}")
+    backend = name
+
+def soup(response, marker, name=None, **attrs): # parse only the container holding the definitions
+    """
+    :param response:    text (or bytes) response from the original lookup query to the mapped online dictionary
+    :param marker:      string (id or class of the container) that occurs in the response if the container is present
+    :param name:        tag name of the container (optional, as for find)
+    :param attrs:       attributes of the container (as for find, e.g. id='BlocArticle' or class_='vg')
+    :return soup:       soup of the container(s) only, an empty soup if the marker does not occur (e.g. word not found)
+    """
+    present = marker.encode('utf-8') in response if isinstance(response, bytes) else marker in response
+    if not present:
+        return bs('', backend)
+    return bs(response, backend, parse_only=SoupStrainer(name, **attrs))
+
 def clean(soup_object):
     cleaned = soup_object.get_text(separator=" ",strip=True)
     cleaned = unicodedata.normalize('NFC', cleaned)
@@ -18,9 +45,8 @@ def parse_larousse_generic (response, word=None):    # generic parser for Larous
     :return parsed:     text string containing the dictionary definitions parsed from the response 
     """
     # identify main content section
-    soup = bs(response, 'html.parser')
     parsed = ""
-    definition_section = soup.find(id='BlocArticle')
+    definition_section = soup(response, 'BlocArticle', id='BlocArticle').find(id='BlocArticle')
 
     if not definition_section:
         return "None"
@@ -108,10 +134,9 @@ parse_es_2 = parse_larousse_generic      # ES: Larousse ES->FR (aliased to parse
 parse_de_2 = parse_larousse_generic      # DE: Larousse DE->FR (aliased to parse_larousse_generic)
 
 def parse_linguee_generic(response, word=None):     # generic parser for Linguee bi-lingual dictionaries
-    soup = bs(response, 'html.parser')
     parsed = ""
     # get main section containing definitions and examples
-    main_section = soup.find(class_='isMainTerm')
+    main_section = soup(response, 'isMainTerm', class_='isMainTerm').find(class_='isMainTerm')
     if not main_section:
         return "None"
 
@@ -196,10 +221,9 @@ def parse_en_1 (response, word=None):    # EN: Merriam-Websters mono-lingual
     :param word:        looked-up word, not needed in most parsers, but included to allow for uniform call across functions
     :return parsed:     text string containing the dictionary definitions parsed from the response 
     """
-    soup = bs(response, 'html.parser')
     parsed = ""
     # Definitions are contained in the section with class 'entry-attr'
-    definitions_section = soup.find('div', class_='vg')
+    definitions_section = soup(response, 'vg', 'div', class_='vg').find('div', class_='vg')
     
     if not definitions_section: 
         return "None"
@@ -232,8 +256,7 @@ def parse_en_2 (response, word=None):    # EN: Larousse EN->DE
     :return parsed:     text string containing the dictionary definitions parsed from the response 
     """
     parsed = ""
-    soup = bs(response, 'html.parser')
-    definitions = soup.find_all(class_='content en-de')
+    definitions = soup(response, 'content en-de', class_='content en-de').find_all(class_='content en-de')
 
     if not definitions:
         return "None"
@@ -255,9 +278,7 @@ def parse_en_4 (response, word=None):    # EN: Larousse EN->SP
     :param word:        looked-up word, not needed in most parsers, but included to allow for uniform call across functions
     :return parsed:     text string containing the dictionary definitions parsed from the response 
     """
-    soup = bs(response, 'html.parser')
-    
-    definition_section = soup.find(class_='content en-es')
+    definition_section = soup(response, 'content en-es', class_='content en-es').find(class_='content en-es')
     if not definition_section:
         return 'None'
     
@@ -279,8 +300,7 @@ def parse_fr_1 (response, word=None):    # FR: Larousse mono-lingual
     :return parsed:     text string containing the dictionary definitions parsed from the response 
     """
     parsed = ""
-    soup = bs(response, 'html.parser')
-    definitions = soup.find_all(class_='DivisionDefinition')
+    definitions = soup(response, 'DivisionDefinition', class_='DivisionDefinition').find_all(class_='DivisionDefinition')
 
     if not definitions:
         return "None"
@@ -307,10 +327,9 @@ def parse_es_1 (response, word=None):    # ES: Real Académia Española mono-lin
     :return parsed:     text string containing the dictionary definitions parsed from the response 
     """
     parsed = ""
-    soup = bs(response, 'html.parser')
     
     # Find the article containing the definitions
-    definitions_section = soup.find('div', id='resultados')
+    definitions_section = soup(response, 'resultados', 'div', id='resultados').find('div', id='resultados')
 
     # Extract the definitions from the <p> tags with class "j"
     if definitions_section:
@@ -340,10 +359,8 @@ def parse_pt_1 (response, word=None):    # PT: Priberam  mono-lingual
     :param word:        word that was looked up (is used in some regex below) 
     :return cleaned:    text string containing the dictionary definitions parsed from the response 
     """
-    soup = bs(response, 'html.parser')
-
     # identify main content section
-    definition_section = soup.find(id='main-container')
+    definition_section = soup(response, 'main-container', id='main-container').find(id='main-container')
     if not definition_section:
         return 'None'
     else:
@@ -366,9 +383,8 @@ def parse_pt_1 (response, word=None):    # PT: Priberam  mono-lingual
     :return parsed:     text string containing the dictionary definitions parsed from the response 
     """
     # identify main content section
-    soup = bs(response, 'html.parser')
     parsed = ""
-    definition_section = soup.find(id='BlocArticle')
+    definition_section = soup(response, 'BlocArticle', id='BlocArticle').find(id='BlocArticle')
 
     if not definition_section:
         return "None"
@@ -0,0 +1,124 @@
+# keep-alive sessions to the dictionary hosts, kept for the whole run and shared by all dictionaries of a host
+# (e.g. the Larousse or Linguee dictionaries of the different languages) and all books looked up in the run.
+# a session's connection pool holds as many connections as lookups may run at the host at once. a session is
+# warmed in the background as soon as the dictionaries are known: the start page is requested as a browser would,
+# so that the first handshake (and any cookies the site sets) overlaps with the menus and the vocab.db queries
+# instead of delaying the first lookups.
+# requests is imported with the first session: runs looking up RAE only (through pyrae) do without it.
+#
+import logging
+import threading
+from urllib.parse import urlsplit
+
+# headers of the first request to a dictionary, as sent by a browser opening the site
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Connection': 'keep-alive'
+}
+
+def site(url): # the part of url identifying the host, sessions are kept per site
+    url = urlsplit(url)
+    return f'{url.scheme}://{url.netloc}/'
+
+def new_session(url, size=1): # create a session with a pool of keep-alive connections to the host of url
+    """
+    :param url:         URL of the dictionary (or any URL of its host)
+    :param size:        maximum number of connections kept open to the host
+    :return session:    request session object
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    # connection errors are retried with backoff, responses of an overloaded host are left to throttled_get
+    retries = Retry(total=3, connect=3, read=2, status=0, backoff_factor=0.5, respect_retry_after_header=False)
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=1, pool_maxsize=max(1, size))
+    session = requests.Session()
+    session.mount(site(url), adapter)
+    return session
+
+def warm(session, url, referer): # open a session: request the start page, leaving a connection to the host open
+    """
+    :param session:     the request session object (see new_session)
+    :param url:         dictionary URL, requested once as a browser would (the site may set cookies)
+    :param referer:     referer sent with that request
+    :return status:     message telling whether the dictionary could be reached
+    """
+    from requests.exceptions import RetryError, HTTPError
+    try:
+        r = session.get(url, timeout=(3, 5), headers={**HEADERS, 'Referer': referer}, allow_redirects=True)
+        r.raise_for_status()
+    except RetryError as err:
+        return f"Error: {err}"
+    except HTTPError as http_err:
+        return f"a https error occured: {http_err}"
+    except Exception as err:
+        return f"some error occured: {err}"
+    return f"Successfully connected to {url}"
+
+class SessionPool:
+    def __init__(self, log_level=logging.WARNING, per_host=1):
+        """
+        :param log_level:   log level for session logging
+        :param per_host:    maximum number of concurrent requests to one host, the size of its connection pool
+                            (the lookups in several dictionaries of a host share it)
+        """
+        logging.getLogger("requests").setLevel(log_level)
+        logging.getLogger("urllib3").setLevel(log_level)
+        self.size = max(1, per_host)
+        self.sessions = {}      # site -> session
+        self.warming = {}       # site -> thread warming the session
+        self.status = {}        # site -> outcome of the warm-up (see warm)
+        self.lock = threading.Lock()
+
+    def session(self, url, referer): # get the session for the host of url, created and warmed if the host is new
+        """
+        :param url:         dictionary URL
+        :param referer:     referer sent when the session is warmed
+        :return session:    request session object, shared by all dictionaries of the host
+        """
+        key = site(url)
+        with self.lock:
+            if key not in self.sessions:
+                session = new_session(url, self.size)
+
+                def run():
+                    self.status[key] = warm(session, url, referer)
+
+                self.sessions[key] = session
+                self.warming[key] = threading.Thread(target=run, daemon=True)
+                self.warming[key].start()
+            return self.sessions[key]
+
+    def warm(self, dicts): # start warming the sessions of dictionaries about to be used
+        """
+        :param dicts:   list of dictionaries (data type); RAE is left out, pyrae connects by itself
+        """
+        for dict in dicts:
+            if dict['url'] != 'https://dle.rae.es/':
+                self.session(dict['url'], dict['referer'])
+
+    def report(self, url, timeout=None): # outcome of warming the session of the host of url, once
+        """
+        :param url:         dictionary URL
+        :param timeout:     seconds to wait for the warm-up to complete at most
+        :return status:     message telling whether the host could be reached (see warm), None if it was reported
+                            before or the warm-up did not complete in time
+        """
+        key = site(url)
+        thread = self.warming.get(key)
+        if thread:
+            thread.join(timeout)
+        return self.status.pop(key, None)
+
+    def wait(self, timeout=None): # wait for all sessions to be warmed
+        for thread in list(self.warming.values()):
+            thread.join(timeout)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
@@ -0,0 +1,74 @@
+# state kept between runs for incremental syncs: per deck (a book's cards of one dictionary and card type, identified
+# by its deck id), the timestamp of the latest lookup (LOOKUPS.timestamp) of the book already turned into cards of
+# the deck and a checksum of the vocab.db it was synced from. lookups that failed (e.g. for network errors) are not
+# passed by the mark: it stays before the earliest of them, so that the next sync looks them up again.
+# the state lives in a small JSON file, written atomically so that an interrupted run leaves the previous state intact.
+#
+import hashlib
+import json
+import os
+
+def load_state(file): # read the sync state
+    """
+    :param file:    path to the JSON state file
+    :return state:  dictionary with 'decks' mapping deck ids to {'timestamp': high-water mark, 'checksum': of vocab.db},
+                    empty if the file does not exist yet
+    """
+    try:
+        with open(file, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+    # the state of earlier versions, kept per book, cannot tell the decks of a book apart: they are synced afresh
+    state.pop('books', None)
+    state.setdefault('decks', {})
+    return state
+
+def save_state(file, state): # write the sync state
+    """
+    :param file:    path to the JSON state file
+    :param state:   the state as returned by load_state and updated since
+    """
+    tmp = file + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, file)
+
+def since(state, deck, checksum): # determine from when on lookups of the book of a deck are new
+    """
+    :param state:       the state as returned by load_state
+    :param deck:        id of the deck to be synced (see kindle2anki.deck_id)
+    :param checksum:    checksum of the current vocab.db
+    :return since:      the high-water mark of the deck (None if never synced), False if vocab.db is unchanged since
+    """
+    synced = state['decks'].get(str(deck))
+    if not synced:
+        return None
+    if synced['checksum'] == checksum:
+        return False
+    return synced['timestamp']
+
+def mark(state, deck, book, checksum, failed=None): # record that all lookups of a book up to its last lookup have been synced to a deck
+    """
+    :param state:       the state as returned by load_state
+    :param deck:        id of the deck synced (see kindle2anki.deck_id)
+    :param book:        the book of the deck (db record, with 'last_lookup' as provided by the book catalog)
+    :param checksum:    checksum of the current vocab.db
+    :param failed:      optional timestamp of the earliest lookup that failed, the deck is synced up to just before it
+                        (and not with this vocab.db, so that the next sync does not skip it as unchanged)
+    """
+    if failed is None:
+        state['decks'][str(deck)] = {'timestamp': book['last_lookup'], 'checksum': checksum}
+    else:
+        state['decks'][str(deck)] = {'timestamp': failed - 1, 'checksum': None}
+
+def checksum(vdb): # checksum of the vocab.db, to tell cheaply whether anything was looked up since the last sync
+    """
+    :param vdb:         path to the vocab.db
+    :return checksum:   hex digest of the file content
+    """
+    h = hashlib.sha256()
+    with open(vdb, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
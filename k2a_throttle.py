@@ -0,0 +1,110 @@
+# adaptive throttling of the requests to a dictionary host: a token bucket whose rate is halved when the host
+# signals overload (429/503, honouring Retry-After) and recovers step by step with every successful response
+# (additive increase, multiplicative decrease), so that lookups settle at the highest rate the site tolerates.
+# a circuit breaker pauses the host after repeated failures, for longer while it keeps failing.
+# one HostThrottle is shared by all threads looking up words at a host.
+#
+import threading
+import time
+
+DEFAULT_RATE = 20.0         # requests per second to one host at most
+THROTTLE_STATUS = (429, 503)    # responses of an overloaded (or throttling) host
+REFUSED_STATUS = (403,)     # responses of a host refusing requests (e.g. blocking bots), failures as server errors (5xx)
+FAILURES = 5                # consecutive failures opening the circuit
+COOLDOWN = 30.0             # seconds a host is paused when the circuit opens, doubled while it keeps failing
+MAX_COOLDOWN = 300.0
+MAX_ATTEMPTS = 6            # failed attempts per request before a word is given up (see HostThrottle.failure)
+
+def retry_after(value): # seconds to wait as requested by a Retry-After header
+    """
+    :param value:       the header value, seconds or an HTTP date (or None)
+    :return seconds:    seconds to wait, None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime   # rarely needed, slow to import
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class HostThrottle:
+    def __init__(self, host, rate=DEFAULT_RATE, burst=1):
+        """
+        :param host:    the host throttled
+        :param rate:    maximum number of requests per second
+        :param burst:   number of requests that may be sent at once after an idle period
+        """
+        self.host = host
+        self.max_rate = rate
+        self.min_rate = rate / 64
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.decreased = 0.0        # when the rate was last halved, it is halved once per second at most
+        self.paused_at = 0.0        # when the last pause began, responses to requests sent before are not counted
+        self.paused_until = 0.0
+        self.failures = 0
+        self.cooldown = COOLDOWN
+        self.lock = threading.Lock()
+
+    def acquire(self): # wait until a request may be sent
+        """
+        :return sent:   the (monotonic) time the request may be sent at, to be passed to failure
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                    self.stamp = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return now
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self): # record a successful response
+        with self.lock:
+            self.failures = 0
+            self.cooldown = COOLDOWN
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+    def failure(self, wait=None, throttled=True, sent=None): # record a failed request
+        """
+        :param wait:        seconds the host asked to wait (Retry-After), if any
+        :param throttled:   True if the host signalled overload, False for other failures (e.g. connection errors)
+        :param sent:        time the request was sent at (see acquire); requests sent before the host was paused
+                            already failed for the reason of the pause and are not counted again
+        :return pause:      tuple (seconds the host is paused, True if the circuit opened, True if the failure counts
+                            as a failed attempt of the request: failures of the host as a whole, i.e. while it is
+                            being slowed down, of requests sent before a pause and the one opening the circuit, do not)
+        """
+        with self.lock:
+            now = time.monotonic()
+            if sent is not None and sent < self.paused_at:
+                return max(0.0, self.paused_until - now), False, False
+            # a host throttling requests is slowed down first, only failing at the lowest rate counts towards the circuit
+            counted = not throttled or self.rate <= self.min_rate
+            if counted:
+                self.failures += 1
+            if throttled and now - self.decreased >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.decreased = now
+            pause = wait or 0.0
+            opened = self.failures >= FAILURES
+            if opened:
+                pause = max(pause, self.cooldown)
+                self.cooldown = min(MAX_COOLDOWN, self.cooldown * 2)
+                self.failures = 0
+            if pause:
+                self.paused_at = now
+                self.paused_until = max(self.paused_until, now + pause)
+                self.tokens = 0
+            return pause, opened, counted and not opened
@@ -0,0 +1,60 @@
+# read-only access to the Kindle's vocab.db. the database is opened through sqlite3 as an immutable, read-only URI
+# (nothing is ever written to it, not even a lock or journal, so it is safe to read straight from the mounted Kindle),
+# memory-mapped, and queried with a fixed set of statements that sqlite3 prepares once per connection and reuses.
+# rows come as sqlite3.Row, read from the database page by page as they are consumed, instead of one dict per row.
+#
+import os
+import sqlite3
+from pathlib import Path
+
+MMAP_LIMIT = 256 * 1024 * 1024  # vocab.db is mapped into memory up to that size
+ROWS = 256                      # rows fetched per round trip of a streaming cursor
+
+# the catalog of books in one aggregated query instead of a COUNT per book
+BOOKS = """
+    SELECT b.id, b.asin, b.lang, b.title, b.authors,
+           COUNT(DISTINCT l.word_key) AS num_words, MAX(l.timestamp) AS last_lookup
+    FROM BOOK_INFO b JOIN LOOKUPS l ON l.book_key = b.id
+    GROUP BY b.id"""
+# the lookups of a book with the stems of the words, joined from WORDS
+USAGE = "SELECT l.word_key, l.usage, l.timestamp, w.stem FROM LOOKUPS l LEFT JOIN WORDS w ON w.id = l.word_key WHERE l.book_key = ?"
+USAGE_SINCE = USAGE + " AND l.timestamp > ?"
+
+class VocabDB:
+    def __init__(self, vdb):
+        """
+        :param vdb:     path to the vocab.db
+        """
+        self.path = vdb
+        uri = Path(vdb).resolve().as_uri() + '?mode=ro'
+        # immutable skips locking and change detection; a database with a write-ahead log not yet checkpointed
+        # (e.g. copied from a Kindle in use) is opened read-only only, so the log is read as well
+        if not os.path.exists(f'{vdb}-wal'):
+            uri += '&immutable=1'
+        self.db = sqlite3.connect(uri, uri=True, cached_statements=16)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(f"PRAGMA mmap_size = {min(os.path.getsize(vdb), MMAP_LIMIT)}")
+
+    def books(self): # the catalog of books for which words were looked up
+        """
+        :return books:  list of books (dicts with the columns of BOOK_INFO) with the count of looked up words
+                        as 'num_words' and the timestamp of the last lookup as 'last_lookup'
+        """
+        # plain dicts: the catalog is cached as JSON and books are passed to the processes writing the decks
+        return [dict(row) for row in self.db.execute(BOOKS)]
+
+    def usage(self, book_id, since=None): # stream the lookups of a book
+        """
+        :param book_id: id of the book (BOOK_INFO.id)
+        :param since:   optional LOOKUPS.timestamp, only lookups after it are read
+        :return cursor: cursor over the lookups (sqlite3.Row with 'word_key', 'usage', 'timestamp' and 'stem'), to be read with
+                        fetchmany (ROWS at a time) or iterated
+        """
+        cursor = self.db.cursor()
+        cursor.arraysize = ROWS
+        if since is None:
+            return cursor.execute(USAGE, (book_id,))
+        return cursor.execute(USAGE_SINCE, (book_id, since))
+
+    def close(self):
+        self.db.close()
@@ -1,39 +1,99 @@
 #!/usr/local/bin/python3
 
 # imports
+# the heavy dependencies (simple_term_menu, requests, chardet, pyrae, genanki and bs4 through the parsers)
+# are imported by the functions using them: -h and invalid arguments do not wait for them, and a run only
+# imports what it uses (e.g. no pyrae unless RAE is looked up, no requests when reparsing archived responses)
 from sys import exit, argv
-from os import path, access, R_OK
+from os import path, access, R_OK, cpu_count
 import argparse
-from cs50 import SQL
-from simple_term_menu import TerminalMenu
-import requests
 import logging
-import chardet
+import codecs
 from urllib.error import HTTPError
-from urllib.parse import quote, unquote
-from requests.adapters import HTTPAdapter
-from requests.exceptions import RetryError
-from pyrae import dle
+from urllib.parse import quote, unquote, urlsplit
+from concurrent.futures import ThreadPoolExecutor, Future, BrokenExecutor
+from functools import lru_cache
+from collections import deque
+from contextlib import contextmanager, ExitStack
+from itertools import chain
+import json
+from threading import BoundedSemaphore, Event, Lock
 import regex as re
-import k2a_response_parsers as p
 import k2a_dictionaries as d
+import k2a_cache as c
+import k2a_state as st
+import k2a_archive as ar
+import k2a_throttle as t
+import k2a_metrics as m
+import k2a_vocab as v
 import hashlib
-from datetime import datetime
-import genanki
+import sqlite3
+import time
+
+DEFAULT_WORKERS = 4     # number of words looked up concurrently
+DEFAULT_PER_HOST = 4    # maximum number of concurrent requests to one dictionary host
+DEFAULT_PARSERS = cpu_count() or 1  # number of processes parsing fetched pages
+
+# suffixes per language used to catch grammatical variations of a word when highlighting it
+SUFFIXES = {
+    'en': ['s', 'ed', 'er', 'ing', 'ly'],
+    'fr': ['s', 'e', 'es', 'er', 'eur', 'euse', 'aux', 'il', 'ille', 'eux', 'x','t', 'te', 'ent' , 'is' ,'it', 'ons', 'ont','ment'],
+    'es': ['s','o','a','os','as','ir','er','ar','í','ó','é','aron','se','ieron','amos','imos','emos','eis','ais','mente','aba'],
+    'pt': ['s','ir','er','ar','a','o','al','este','amos','emos','imos','ou','ei','i','ão','ões','aste','aram','eram','mente','ava'],
+    'de': ['e','st','er','s','t','d','en','ig','lich','ung','keit'],
+}
+SYLLABLES = re.compile(r'(\b\w+·){1,}\w+\b')  # syllable separated spelling (like 'sel·va·gem')
+
+# encodings declared by a response: charset of the Content-Type header or of a meta tag near the top of the page
+CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', flags=re.IGNORECASE)
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', flags=re.IGNORECASE)
+META_BYTES = 4096       # bytes of a page searched for a meta charset
+DETECT_BYTES = 64 * 1024    # bytes of a page the encoding is detected on if none is declared
+NON_ASCII = re.compile(rb'[\x80-\xff]')    # detection starts at the first byte that can tell encodings apart
+
+host_slots = {}         # host -> semaphore bounding concurrent requests to that host
+host_slots_lock = Lock()
+host_throttles = {}     # host -> HostThrottle adapting the request rate to that host
 
 def main(): # main program
     # check command line args and deternine db and deck file
     args = checkargs(argv)
     vdb = args['vdb']
     deckname = args['deck']
-    num_log_level = args['num_log_level']
-    string_log_level = args['string_log_level']
+    if args['backend'] != 'html.parser':
+        import k2a_response_parsers as p
+        p.set_backend(args['backend'])
+    # instrumentation of the run, report and profile are written when the program ends
+    if args['metrics'] or args['profile']:
+        m.start(args['metrics'], args['profile'], {'argv': argv[1:], 'workers': args['workers'], 'parsers': args['parsers'],
+                                                   'per_host': args['per_host'], 'rate': args['rate'], 'backend': args['backend']})
+    cache = c.DefinitionCache(args['cache'], ttl=args['ttl'], miss_ttl=args['miss_ttl']) if args['cache'] else None
+    archive = ar.ResponseArchive(args['archive']) if args['archive'] else None
+    # connections to the dictionary hosts, kept for the whole run (none needed to reparse archived responses)
+    sessions = None
+    if not args['reparse']:
+        import k2a_sessions as se
+        sessions = se.SessionPool(args['num_log_level'], args['per_host'])
 
-    # get database handle
-    db = SQL(f"sqlite:///{vdb}")
+    # get database handle (read-only, see k2a_vocab)
+    with m.metrics.timed('vocab.db'):
+        db = v.VocabDB(vdb)
+
+    # headless mode: build all decks listed in the batch spec
+    if args['batch']:
+        run_batch(db, args['batch'], args, cache, archive, sessions)
+        if cache:
+            cache.close()
+        if archive:
+            archive_metrics(archive)
+            archive.close()
+        if sessions:
+            sessions.close()
+        db.close()
+        return
 
     # select book for deck
-    book = select_book(db)
+    book = select_book(db, vdb, cache)
 
     # get list of dictionaries dictionaries with source language 
     # matching the language of the chosen book
@@ -43,58 +103,383 @@ def main(): # main program
 
     # select one of the dicitionaries available for the source language
     dict = select_dictionary(dicts)
-    if dict['url'] == 'https://dle.rae.es/':
-        rae = True
-    else:
-        rae = False
+    # ... followed by those to fall back on (or merge with)
+    dict_chain = [dict] + fallback_dictionaries(dicts, dict, args['fallback'])
+    # connect to their hosts while the card type is selected and the looked-up words are read
+    if sessions:
+        sessions.warm(dict_chain)
 
-    
     # select a card type (A or B) for the cards in the deck to be created
     card_type = select_card_type()
 
-    # get a dictionary mapping 'usages' (i.e. the text passages where the looked up words occured)
-    # as values to the words as keys 
-    usage = get_usage(db, book)
+    # incremental sync: only lookups added since the deck was last synced
+    since = None
+    if args['incremental']:
+        state = st.load_state(args['state'])
+        checksum = st.checksum(vdb)
+        deck = deck_id(book, dict, card_type)
+        since = st.since(state, deck, checksum)
+        if since is False:
+            exit(f"vocab.db unchanged since last sync of {deckname} for '{book['title']}' - nothing to do")
 
-    # for conveniece get the words (keys of usage) as a list
-    words = list(usage.keys())
+    # stream the looked up words with their 'usages' (i.e. the text passages where the looked up words occured)
+    # from vocab.db through the dictionary lookups into the deck, cards are added as their definitions come in
+    records = iter_usage(db, book, since)
+    first = next(records, None)
+    if args['incremental'] and first is None:
+        st.mark(state, deck, book, checksum)
+        st.save_state(args['state'], state)
+        exit(f"no new lookups in '{book['title']}' since last sync of {deckname} - nothing to do")
+    records = chain([first], records) if first else iter(())
 
-    # establish a connection to the dictionary URL of the chosen dictionary
-    if rae == False:
-        session = connect(dict['url'], dict['referer'], num_log_level)
+    # retrieve dictinary definitions for the words in our book that were looked up in kindle,
+    # create the card deck and write it out to a apkg file
+    failed = []
+    with dictionary_fetches(dict_chain, args, archive, cache, sessions) as fetches:
+        records = stream_chain(dict_chain, records, fetches, cache, args['workers'], args['parsers'], args['reparse'], args['recheck'], args['merge'])
+        has_cards = build_deck(deckname, dict, card_type, note_failures(records, failed), book, args['update'])
+    if cache:
+        cache.close()
+    if archive:
+        archive_metrics(archive)
+        archive.close()
+    if sessions:
+        sessions.close()
+    if args['incremental'] and has_cards:
+        if failed:
+            print(f"{len(failed)} words could not be looked up - they are looked up again on the next sync")
+        st.mark(state, deck, book, checksum, min(failed, default=None))
+        st.save_state(args['state'], state)
+    if has_cards == False:
+        exit(f'\nToo bad - no definitions found in selected dictionary for words in selected book!\n')
 
-        # retrieve dictinary definitions for the words in our book that were looked up in kindle
-        titles, definitions = get_definitions(session, dict, words, num_log_level)
+def archive_metrics(archive): # record the size of the response archive for the metrics report
+    """
+    :param archive:     the ResponseArchive of the run
+    """
+    if m.metrics.enabled:
+        lookups, bodies, size, stored = archive.stats()
+        m.metrics.count('archive/lookups', lookups)
+        m.metrics.count('archive/bodies', bodies)
+        m.metrics.count('archive/bytes', size)
+        m.metrics.count('archive/stored_bytes', stored)
 
-        # close the https session
-        session.close()
+def fetch_definitions(dicts, words, args, cache=None, archive=None, stems=None, merge=False, sessions=None): # look up words in a chain of dictionaries
+    """
+    :param dicts:       list of dictionaries (data type) to be used for lookups, in order (see stream_chain)
+    :param words:       the list of words to be looked up
+    :param args:        the evaluated command line arguments (see checkargs)
+    :param cache:       optional DefinitionCache
+    :param archive:     optional ResponseArchive (see dictionary_fetch)
+    :param stems:       optional dictionary of the stems of words, words sharing a stem are looked up once
+    :param merge:       look words up in all dictionaries and merge the definitions (see stream_chain)
+    :param sessions:    optional SessionPool (see dictionary_fetch)
+    :return titles, definitions: dictionaries of card titles and definitions with looked up words as keys
+    """
+    definitions = {}
+    titles = {}
+    with dictionary_fetches(dicts, args, archive, cache, sessions) as fetches:
+        records = ({'word': word, 'stem': stems.get(word) if stems else None} for word in words)
+        for record in stream_chain(dicts, records, fetches, cache, args['workers'], args['parsers'], args['reparse'], args['recheck'], merge):
+            if record['title'] is not None:
+                titles[record['word']] = record['title']
+            definitions[record['word']] = record['definition']
+    return titles, definitions
+
+@contextmanager
+def dictionary_fetches(dicts, args, archive=None, cache=None, sessions=None): # connect to several dictionaries for the duration of the lookups
+    """
+    :param dicts:       list of dictionaries (data type) to be used for lookups
+    :param args:        the evaluated command line arguments (see checkargs)
+    :param archive:     optional ResponseArchive (see dictionary_fetch)
+    :param cache:       optional DefinitionCache (see dictionary_fetch)
+    :param sessions:    optional SessionPool (see dictionary_fetch)
+    :return fetches:    (yielded) list of fetch functions, one per dictionary
+    """
+    with ExitStack() as stack:
+        yield [stack.enter_context(dictionary_fetch(dict, args, archive, cache, sessions)) for dict in dicts]
+
+@contextmanager
+def dictionary_fetch(dict, args, archive=None, cache=None, sessions=None): # connect to a dictionary for the duration of the lookups
+    """
+    :param dict:        a dictionary (data type) containing information about the 
+                        (online language) dictionary to be used for lookups
+    :param args:        the evaluated command line arguments (see checkargs)
+    :param archive:     optional ResponseArchive the responses are stored in,
+                        or (with args['reparse']) read from instead of the dictionary site
+    :param cache:       optional DefinitionCache keeping the encoding detected for the dictionary (see make_fetch)
+    :param sessions:    optional SessionPool keeping the connection to the dictionary's host open for further lookups,
+                        without one the connection is closed after the lookups
+    :return fetch:      (yielded) function taking a word and returning (final url, response text)
+    """
+    if args['reparse']:
+        # no connection at all, the responses come from the archive
+        print(f"Reparsing archived responses of {dict['url']}...")
+        yield make_fetch_archive(dict, archive)
+        return
+    print(f"Looking up words at {dict['url']}...")
+    # establish a connection to the dictionary URL of the chosen dictionary (or reuse the one to its host)
+    if dict['url'] != 'https://dle.rae.es/':
+        import k2a_sessions as se
+        pool = sessions or se.SessionPool(args['num_log_level'], args['per_host'])
+        session = pool.session(dict['url'], dict['referer'])
+        # the lookups start once the host answered the warm-up (mostly while the menus were answered)
+        status = pool.report(dict['url'])
+        if status:
+            print(status)
+        try:
+            yield make_fetch(session, dict, args['num_log_level'], args['per_host'], archive, cache, args['rate'])
+        finally:
+            # close the https session unless it is kept for the run
+            if pool is not sessions:
+                pool.close()
     else:
         # connection will be handled by pyrae module
-        definitions = get_definitions_rae(words, string_log_level)
-    
+        yield make_fetch_rae(args['string_log_level'], args['per_host'], archive, args['rate'])
+
+def note_failures(records, failed): # pass a stream of looked-up words on, noting when the words that failed were looked up
+    """
+    :param records:     iterable of looked-up words (see stream_chain), a 'title' of None marks a failed lookup
+    :param failed:      list the 'timestamp' of each failed lookup is appended to
+    :return record:     (yields) the records unchanged
+    """
+    for record in records:
+        if record['title'] is None:
+            failed.append(record['timestamp'])
+        yield record
+
+def build_deck(deckname, dict, card_type, records, book=None, update=False): # create a card deck, fill it and write it out
+    """
+    :param deckname:    name of the card deck, also the name of the apkg file written
+    :param dict:        the dictionary object used
+    :param card_type:   the card type selected (A or B)
+    :param records:     iterable (e.g. a stream) of looked-up words, one card is created per word (see add_cards)
+    :param book:        the book the deck is created for (determines the deck id)
+    :param update:      merge the cards into an existing apkg file of that name instead of replacing it
+    :return has_cards:  True if the deck was written, False if it had no cards (nothing is written then)
+    """
+    import genanki
     # create the anki card deck
-    deck = create_deck(deckname)
+    deck = create_deck(deckname, book, dict, card_type)
 
     # add cards to the card deck (of the chosen card type, one per word)
-    has_cards = create_cards(deck, dict, card_type, words, usage, titles, definitions)
+    has_cards = add_cards(deck, dict, card_type, records)
+
+    # keep the notes of the existing deck that were not rebuilt
+    if update:
+        existing = read_notes(deckname)
+        rebuilt = {note.guid: note.fields for note in deck.notes}
+        changed = sum(1 for guid in rebuilt if guid in existing and existing[guid] != rebuilt[guid])
+        added = sum(1 for guid in rebuilt if guid not in existing)
+        basic_model = card_model()
+        for guid, fields in existing.items():
+            if guid not in rebuilt:
+                deck.add_note(genanki.Note(model = basic_model, fields = fields, guid = guid))
+        print(f'updating {deckname}: {added} cards added, {changed} changed, {len(rebuilt) - added - changed} unchanged')
+        has_cards = bool(deck.notes)
+
     if has_cards == False:
-        exit(f'\nToo bad - no definitions found in selected dictionary for words in selected book!\n')
+        return False
 
     # write out card deck to a apkg file
     print(f'writing out card deck to {deckname}...', end="")
-    genanki.Package(deck).write_to_file(deckname)
+    with m.metrics.timed('write'):
+        genanki.Package(deck).write_to_file(deckname)
     print('done')
+    return True
+
+def run_batch(db, spec, args, cache=None, archive=None, sessions=None): # build decks for all books listed in a batch spec without prompting
+    """
+    :param db:          the vocab.db (see k2a_vocab.VocabDB)
+    :param spec:        the batch spec as read by load_batch
+    :param args:        the evaluated command line arguments (see checkargs)
+    :param cache:       optional DefinitionCache
+    :param archive:     optional ResponseArchive (see dictionary_fetch)
+    :param sessions:    optional SessionPool, shared by the lookups of all books (see dictionary_fetch)
+    """
+    books = get_books(db, args['vdb'], cache)
+    defaults = spec.get('defaults', {})
+    jobs = []
+
+    # resolve books, dictionaries and card types of all decks before looking anything up
+    for entry in spec['decks']:
+        entry = {**defaults, **entry}
+        matched = match_books(books, str(entry['book']))
+        if not matched:
+            print(f"no book matching '{entry['book']}' - skipping ...")
+            continue
+        if 'deck' in entry and len(matched) > 1:
+            exit(f"batch spec: '{entry['book']}' matches {len(matched)} books, but deck {entry['deck']} can hold only one")
+        for book in matched:
+            try:
+                dicts = d.get_dictionaries(book['lang'])
+            except ValueError:
+                print(f"no dictionary as yet configured for language '{book['lang']}' of '{book['title']}' - skipping ...")
+                continue
+            ids = entry['dictionary'] if isinstance(entry['dictionary'], list) else [entry['dictionary']]
+            dict_chain = [next((dict for dict in dicts if dict['id'] == id), None) for id in ids]
+            if None in dict_chain:
+                print(f"no dictionary with id {ids[dict_chain.index(None)]} for language '{book['lang']}' of '{book['title']}' - skipping ...")
+                continue
+            named = 'deck' in entry
+            if named:
+                deckname = entry['deck']
+            else:
+                deckname = re.sub(r'[^\w\-]+', '_', book['title']).strip('_') or book['id']
+            if deckname.endswith('.apkg'):
+                deckname = deckname[:-len('.apkg')]
+            # every deck is written by a process of its own, no two may write the same file
+            taken = {job['deck'] for job in jobs}
+            if deckname + '.apkg' in taken:
+                if named:
+                    exit(f"batch spec: more than one deck would be written to {deckname}.apkg")
+                # e.g. several editions of one title (which may share their ASIN, but not their id)
+                deckname = base = deckname + '_' + re.sub(r'[^\w\-]+', '_', book['id']).strip('_')
+                n = 2
+                while deckname + '.apkg' in taken:
+                    deckname = f'{base}_{n}'
+                    n += 1
+            deckname += '.apkg'
+            jobs.append({'book': book, 'dict': dict_chain[0], 'chain': dict_chain, 'merge': entry.get('merge', False),
+                         'card_type': entry['card_type'], 'deck': deckname})
+
+    # incremental sync: only lookups added since a deck was last synced
+    if args['incremental']:
+        state = st.load_state(args['state'])
+        checksum = st.checksum(args['vdb'])
+    for job in jobs:
+        job['id'] = deck_id(job['book'], job['dict'], job['card_type'])
+        since = st.since(state, job['id'], checksum) if args['incremental'] else None
+        job['records'] = list(iter_usage(db, job['book'], since)) if since is not False else []
+        if args['incremental'] and not job['records']:
+            print(f"no new lookups in '{job['book']['title']}' since last sync of {job['deck']} - skipping ...")
+            st.mark(state, job['id'], job['book'], checksum)
+    jobs = [job for job in jobs if job['records']]
+    # connect to the hosts of all dictionaries at once, the lookups in each reuse the connections
+    if sessions:
+        sessions.warm([dict for job in jobs for dict in job['chain']])
+
+    # look up the words of all books sharing dictionaries in one go
+    lookups = {}
+    for job in jobs:
+        job['key'] = (job['dict']['src_lang'], tuple(dict['id'] for dict in job['chain']), job['merge'])
+        stems = lookups.setdefault(job['key'], (job['chain'], {}))[1]
+        stems.update((record['word'], record['stem']) for record in job['records'])    # ordered set of words
+    results = {}
+    for key, (dict_chain, stems) in lookups.items():
+        results[key] = fetch_definitions(dict_chain, list(stems), args, cache, archive, stems, key[2], sessions)
+
+    # independent decks are assembled and written in parallel
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(mp_context=process_context()) as pool:
+        futures = []
+        for job in jobs:
+            titles, definitions = results[job['key']]
+            records = [{**record, 'title': titles.get(record['word']), 'definition': definitions[record['word']]}
+                       for record in job['records']]
+            job['failed'] = [record['timestamp'] for record in records if record['title'] is None]
+            deck_args = (job['deck'], job['dict'], job['card_type'], records, job['book'], args['update'])
+            if m.metrics.enabled:
+                # the processes record on their own, merged below
+                futures.append((job['deck'], pool.submit(m.collect, build_deck, *deck_args)))
+            else:
+                futures.append((job['deck'], pool.submit(build_deck, *deck_args)))
+        for job, (deckname, future) in zip(jobs, futures):
+            has_cards = future.result()
+            if m.metrics.enabled:
+                has_cards, recorded = has_cards
+                m.metrics.merge(recorded)
+            if not has_cards:
+                print(f"no definitions found for words of {deckname} - not written")
+            elif args['incremental']:
+                if job['failed']:
+                    print(f"{len(job['failed'])} words of {deckname} could not be looked up - they are looked up again on the next sync")
+                st.mark(state, job['id'], job['book'], checksum, min(job['failed'], default=None))
+
+    if args['incremental']:
+        st.save_state(args['state'], state)
+
+def load_batch(file): # read and check a batch spec (JSON or TOML) listing the decks to be built
+    """
+    :param file:    path to the batch spec, e.g.
+                    {"defaults": {"dictionary": 1, "card_type": "A"},
+                     "decks": [{"book": "B005306NQM"}, {"book": "grapes of wrath", "dictionary": 5, "deck": "grapes"}]}
+                    where "book" is an ASIN, a book id or a (case-insensitive regex) pattern matched against titles,
+                    "dictionary" may also list several ids, to fall back on in order or ("merge": true) to merge
+    :return spec:   the batch spec as dictionary
+    """
+    try:
+        if file.lower().endswith('.toml'):
+            import tomllib
+            with open(file, 'rb') as f:
+                spec = tomllib.load(f)
+        else:
+            with open(file, encoding='utf-8') as f:
+                spec = json.load(f)
+    except (OSError, ValueError) as err:
+        exit(f"cannot read batch spec {file}: {err}")
+
+    if not isinstance(spec, dict) or not isinstance(spec.get('decks'), list) or not spec['decks']:
+        exit(f"batch spec {file} lists no decks")
+    defaults = spec.get('defaults', {})
+    if not isinstance(defaults, dict):
+        exit(f"batch spec {file}: invalid defaults {defaults}, expected a table of deck settings")
+    if 'deck' in defaults:
+        exit(f"batch spec {file}: a deck name cannot be a default, it names the deck of one book")
+    for entry in spec['decks']:
+        if not isinstance(entry, dict):
+            exit(f"batch spec {file}: invalid deck {entry}, expected a table of deck settings")
+        entry = {**defaults, **entry}
+        for key in ('book', 'dictionary', 'card_type'):
+            if key not in entry:
+                exit(f"batch spec {file}: '{key}' missing for deck {entry}")
+        ids = entry['dictionary'] if isinstance(entry['dictionary'], list) else [entry['dictionary']]
+        if not ids or not all(isinstance(id, int) for id in ids):
+            exit(f"batch spec {file}: invalid dictionary {entry['dictionary']}, expected an id or a list of ids")
+        if entry['card_type'] not in ('A', 'B'):
+            exit(f"batch spec {file}: invalid card type '{entry['card_type']}', valid types are A and B")
+        if not isinstance(entry.get('deck', ''), str):
+            exit(f"batch spec {file}: invalid deck name {entry['deck']}, expected a file name")
+    return spec
 
 def checkargs(argv): # check and evaluate command line input
     """
     :param argv:    array of command line arguments to be parsed and interpreted  
-    :return dict:   anonymous dictionary containing 'vdb' (the path to the kindle vocabluary database)
-                    and 'deck' (the name of the Anki card deck to be created)
+    :return dict:   anonymous dictionary containing 'vdb' (the path to the kindle vocabluary database),
+                    'deck' (the name of the Anki card deck to be created), the log levels and 'cache'/'ttl'
+                    (path to and time to live of the definition cache, 'cache' is None if caching is disabled),
+                    'miss_ttl' and 'recheck' (time to live of words not found and whether to look them up regardless),
+                    'workers', 'per_host', 'rate' and 'parsers' (lookup concurrency and request rate), 'batch' (the batch spec or None),
+                    'incremental' and 'state' (whether to sync incrementally and the path to the sync state file),
+                    'update' (whether to merge cards into an existing deck file), 'archive' (path to the
+                    response archive or None), 'reparse' (whether to parse archived responses instead of fetching),
+                    'fallback' (ids of dictionaries to fall back on, 'all' or None), 'merge' (whether to merge them),
+                    'backend' (the tree builder used by the parsers), 'metrics' and 'profile' (paths of the metrics
+                    report and the cProfile dump, or None)
     """
     parser = argparse.ArgumentParser(description="Create Anki card decks from Kindle vocabluary database")
     parser.add_argument("-k", default="default", help="Path to directory where kindle vocab.db resides, default='.'", type=str)
     parser.add_argument("-d", default="default", help="Name of Anki card deck, default='default.apkg'", type=str)
     parser.add_argument("-l", default="WARNING", help="log level for http(s) sessions, default='WARNING'", type=str)
+    parser.add_argument("-c", default="default", help="Path to definition cache file, default='k2a_cache.db' next to this script", type=str)
+    parser.add_argument("-t", default=30, help="Days before cached definitions are looked up again, default=30", type=int)
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the definition cache")
+    parser.add_argument("--miss-ttl", default=7, help="Days before words not found in a dictionary are looked up again, default=7", type=int)
+    parser.add_argument("--recheck", action="store_true", help="Look up words again that were not found in the dictionary before")
+    parser.add_argument("-w", default=DEFAULT_WORKERS, help=f"Number of words looked up concurrently, default={DEFAULT_WORKERS}", type=int)
+    parser.add_argument("-b", default=None, help="Batch spec (JSON or TOML) listing decks to build without prompting", type=str)
+    parser.add_argument("-i", action="store_true", help="Incremental sync: only words looked up since the last run for a deck (book, dictionary and card type)")
+    parser.add_argument("-u", action="store_true", help="Update existing deck file: keep its cards, add new and replace changed ones")
+    parser.add_argument("-P", default=DEFAULT_PARSERS, help="Number of processes parsing fetched pages (0: parse while fetching), default=number of CPUs", type=int)
+    parser.add_argument("--rate", default=t.DEFAULT_RATE, help=f"Maximum requests per second per dictionary host, lowered while a host signals overload, default={t.DEFAULT_RATE:g}", type=float)
+    parser.add_argument("--per-host", default=DEFAULT_PER_HOST, help=f"Maximum concurrent requests per dictionary host, default={DEFAULT_PER_HOST}", type=int)
+    parser.add_argument("-a", nargs="?", const="default", default=None, help="Archive raw dictionary responses, to the given file or 'k2a_archive.db' next to this script", type=str)
+    parser.add_argument("--fallback", default=None, help="Dictionary ids (comma-separated, or 'all') to look up words the selected dictionary lacks, in order", type=str)
+    parser.add_argument("--merge", action="store_true", help="Look words up in the selected and the --fallback dictionaries at once and merge the definitions into one card")
+    parser.add_argument("--reparse", action="store_true", help="Parse definitions from the response archive (-a) instead of looking words up, no network access")
+    parser.add_argument("--metrics", nargs="?", const="default", default=None, help="Write timings per stage, latencies, cache hits and bytes transferred as JSON report, to the given file or 'k2a_metrics.json' next to this script", type=str)
+    parser.add_argument("--lxml", action="store_true", help="Parse responses with lxml (much faster, needs the lxml package) instead of html.parser")
+    parser.add_argument("--profile", default=None, help="Write a cProfile dump of the main and lookup threads to this file (parse processes are not profiled, see -P)", type=str)
     args = parser.parse_args()
     
     # determine kindle vocab.db
@@ -134,25 +519,82 @@ def checkargs(argv): # check and evaluate command line input
     if num_log_level is None:
         exit(f'Invalid log level: {string_log_level}')
 
-    return {'vdb': vdb, 'deck': deckname, 'num_log_level': num_log_level, 'string_log_level': string_log_level}
+    # determine definition cache
+    if args.no_cache:
+        cache = None
+    elif args.c == "default":
+        cache = path.join(path.split(path.realpath(argv[0]))[0], "k2a_cache.db")
+    else:
+        cache = args.c
+    if args.t < 0 or args.miss_ttl < 0:
+        exit("Invalid cache time to live: must not be negative")
+
+    # determine lookup concurrency
+    if args.w < 1 or args.per_host < 1:
+        exit("Invalid concurrency: worker count and per-host limit must be at least 1")
+    if args.P < 0:
+        exit("Invalid concurrency: number of parse processes must not be negative")
+    if args.rate <= 0:
+        exit("Invalid rate: must be positive")
+
+    # determine response archive, reparsing needs one to read from
+    if args.a == "default" or (args.reparse and args.a is None):
+        archive = path.join(path.split(path.realpath(argv[0]))[0], "k2a_archive.db")
+    else:
+        archive = args.a
+    if args.reparse and not path.isfile(archive):
+        exit(f"no response archive found at {archive} - nothing to reparse")
+
+    # determine fallback dictionaries
+    if args.fallback is None or args.fallback == 'all':
+        fallback = args.fallback
+    elif re.fullmatch(r'\d+(,\d+)*', args.fallback):
+        fallback = [int(id) for id in args.fallback.split(',')]
+    else:
+        exit("Invalid fallback: expected comma-separated dictionary ids or 'all'")
+    if args.merge and fallback is None:
+        exit("--merge needs the dictionaries to merge with (--fallback)")
 
-def select_book(db): # select a Kindle book for which a vocab card deck is to be created
+    # determine parse backend
+    if args.lxml:
+        try:
+            import lxml
+        except ImportError:
+            exit("--lxml needs the lxml package (pip install lxml)")
+    backend = 'lxml' if args.lxml else 'html.parser'
+
+    # determine metrics report
+    if args.metrics == "default":
+        metrics = path.join(path.split(path.realpath(argv[0]))[0], "k2a_metrics.json")
+    else:
+        metrics = args.metrics
+
+    # sync state for incremental runs lives next to our script
+    state = path.join(path.split(path.realpath(argv[0]))[0], "k2a_state.json")
+
+    # read batch spec
+    batch = load_batch(args.b) if args.b else None
+
+    return {'vdb': vdb, 'deck': deckname, 'num_log_level': num_log_level, 'string_log_level': string_log_level,
+            'cache': cache, 'ttl': args.t * 24 * 3600, 'miss_ttl': args.miss_ttl * 24 * 3600, 'recheck': args.recheck, 'workers': args.w, 'per_host': args.per_host, 'rate': args.rate, 'parsers': args.P,
+            'batch': batch, 'incremental': args.i, 'state': state,
+            'update': args.u, 'archive': archive, 'reparse': args.reparse, 'fallback': fallback, 'merge': args.merge,
+            'backend': backend, 'metrics': metrics, 'profile': args.profile}
+
+def select_book(db, vdb=None, cache=None): # select a Kindle book for which a vocab card deck is to be created
     """
-    :param db:      database handle to kindle sqlite vocab database 
+    :param db:      the vocab.db (see k2a_vocab.VocabDB)
+    :param vdb:     path to the vocab.db (see get_books)
+    :param cache:   optional DefinitionCache holding the book catalog (see get_books)
     :return book:   Kindle e-book (db record) selected by user for vocab queries
     """
-    # get keys of books for which we have looked up vocab
-    key_dict = db.execute("SELECT DISTINCT(book_key) FROM LOOKUPS")
-    book_keys = [key['book_key'] for key in key_dict]
-    book_info = db.execute("SELECT id, lang, title, authors FROM BOOK_INFO WHERE id IN (?)", book_keys)
+    book_info = get_books(db, vdb, cache)
     
     options = [] # for building menu opions
     book_id = {} # for looking up book_key for selected menu option
 
     for book in book_info:
         id = book['id']
-        num_words = list(db.execute("SELECT COUNT(DISTINCT(word_key)) FROM LOOKUPS WHERE book_key = ?", id)[0].values())[0]
-        book['num_words'] = num_words
         option_keys = ['lang', 'title', 'authors', 'num_words']
         option = '::'.join(str(book[key]) for key in option_keys)
         options.append(option)
@@ -168,6 +610,7 @@ Options for Selection will be presented in format:
             
 Press any key to continue ...
 """)
+        from simple_term_menu import TerminalMenu
         terminal_menu = TerminalMenu(options, title='Books:')
         menu_entry_index = terminal_menu.show()
         
@@ -184,6 +627,41 @@ Press any key to continue ...
     # return the book dict for the selection
     return next((book for book in book_info if book['id'] == book_id[options[menu_entry_index]]), None)
 
+def get_books(db, vdb=None, cache=None): # get the catalog of books for which words were looked up
+    """
+    :param db:          the vocab.db (see k2a_vocab.VocabDB)
+    :param vdb:         path to the vocab.db, needed to validate a cached catalog
+    :param cache:       optional DefinitionCache that keeps the catalog as long as vocab.db is unchanged
+    :return book_info:  list of books (db records of BOOK_INFO) with the count of looked up words added as 'num_words'
+                        and the timestamp of the last lookup as 'last_lookup'
+    """
+    if cache and vdb:
+        book_info = cache.get_catalog(vdb)
+        if book_info is not None:
+            return book_info
+
+    with m.metrics.timed('vocab.db'):
+        book_info = db.books()
+
+    if cache and vdb:
+        cache.put_catalog(vdb, book_info)
+    return book_info
+
+def match_books(books, pattern): # find the books a batch spec entry refers to
+    """
+    :param books:       list of books as returned by get_books
+    :param pattern:     ASIN or id of a book, or a pattern (case-insensitive regex) matched against book titles
+    :return matched:    list of matching books
+    """
+    matched = [book for book in books if pattern in (book['asin'], book['id'])]
+    if matched:
+        return matched
+    try:
+        title = re.compile(pattern, flags=re.IGNORECASE)
+    except re.error:
+        title = re.compile(re.escape(pattern), flags=re.IGNORECASE)
+    return [book for book in books if title.search(book['title'] or '')]
+
 def select_card_type(): # select card type 'A' (definitions on the back) or 'B' (definitions on the front)
    """
    :param :             this function takes no params
@@ -199,6 +677,7 @@ Please select card type for your card deck:
 Press any key to continue ...
 """)
 
+        from simple_term_menu import TerminalMenu
         terminal_menu = TerminalMenu(options, title='Card Type:')
         menu_entry_index = terminal_menu.show() 
 
@@ -212,20 +691,46 @@ Press any key to continue ...
         except TypeError:
             continue 
 
-def get_usage(db, book): # retrieve text passages with looked-up words from kindle db
+def get_usage(db, book, since=None): # retrieve text passages with looked-up words from kindle db
     """
-    :param db :     the sqllite database-handle to the kindle database
+    :param db :     the vocab.db (see k2a_vocab.VocabDB)
     :param book:    the book selected 
+    :param since:   optional LOOKUPS.timestamp, only words looked up after it are retrieved
     :return usage:  a dictionary with the looked-up words as keys and 'usages' (i.e. the text passages 
                     in the e-book) where the looked-up word occured as values
+    :return stems:  a dictionary with the looked-up words as keys and their stems (as recorded by Kindle in WORDS) as values
     """
     usage = {}
-    worddicts = db.execute("SELECT word_key, usage FROM LOOKUPS WHERE book_key = ?", book['id'])
-    for worddict in worddicts:
-        word = worddict['word_key'].split(':')[1]
-        if not word in usage:
-            usage[word] = worddict['usage'].replace(word, f"<b>{word}</b>")
-    return usage
+    stems = {}
+    for record in iter_usage(db, book, since):
+        usage[record['word']] = record['usage']
+        stems[record['word']] = record['stem']
+    return usage, stems
+
+def iter_usage(db, book, since=None): # stream the looked-up words of a book from kindle db
+    """
+    :param db :     the vocab.db (see k2a_vocab.VocabDB)
+    :param book:    the book selected 
+    :param since:   optional LOOKUPS.timestamp, only words looked up after it are retrieved
+    :return record: (yields) one dictionary per looked-up word with 'word', 'usage' (the text passage of the first
+                    lookup of the word, with the word in bold-face), 'stem' (as recorded by Kindle in WORDS)
+                    and 'timestamp' (of that lookup)
+    """
+    seen = set()
+    # stems come along in the same query, joined from WORDS; rows are read as the words are consumed
+    with m.metrics.timed('vocab.db'):
+        rows = db.usage(book['id'], since)
+    while True:
+        with m.metrics.timed('vocab.db'):
+            worddicts = rows.fetchmany()
+        if not worddicts:
+            break
+        for worddict in worddicts:
+            word = worddict['word_key'].split(':')[1]
+            if not word in seen:
+                seen.add(word)
+                yield {'word': word, 'usage': worddict['usage'].replace(word, f"<b>{word}</b>"), 'stem': worddict['stem'],
+                       'timestamp': worddict['timestamp']}
 
 def select_dictionary(dicts): # select a dictionary for the lookups
     """
@@ -250,6 +755,7 @@ Options for selection will be presented in format:
             
 Press any key to continue ...
 """)
+        from simple_term_menu import TerminalMenu
         terminal_menu = TerminalMenu(options, title='Dictionaries:')
         menu_entry_index = terminal_menu.show()
 
@@ -264,111 +770,514 @@ Press any key to continue ...
 
     return next((dict for dict in dicts if dict['id'] == dict_id[options[menu_entry_index]]), None)
 
-def get_definitions(session, dict, words, log_level):  # retrieve dictionary definitions for the looked-up words from the chosen Kindle book
+def fallback_dictionaries(dicts, dict, fallback): # determine the dictionaries to fall back on
+    """
+    :param dicts:       the dictionaries matching the language of the chosen book
+    :param dict:        the chosen dictionary
+    :param fallback:    list of dictionary ids, 'all' for all other dictionaries or None
+    :return dicts:      the dictionaries to fall back on, in order
+    """
+    if fallback is None:
+        return []
+    if fallback == 'all':
+        return [other for other in dicts if other is not dict]
+    others = []
+    for id in fallback:
+        other = next((other for other in dicts if other['id'] == id), None)
+        if other is None:
+            exit(f"no dictionary with id {id} for language '{dict['src_lang']}'")
+        if other is not dict:
+            others.append(other)
+    return others
+
+def make_fetch(session, dict, log_level, per_host=DEFAULT_PER_HOST, archive=None, cache=None, rate=t.DEFAULT_RATE): # create the function fetching dictionary pages for words
     """
     :param session:     the request session object to be used for get requests
     :param dict:        a dictionary (data type) containing information about the 
                         (online language) dictionary to be used for lookups
-    :param words:       the list of words to be looked up    
-    :return definitions: a dictionary of definitions with looked up words as keys
+    :param log_level:   log level for encoding detection
+    :param per_host:    maximum number of concurrent requests to one dictionary host
+    :param archive:     optional ResponseArchive every response is stored in
+    :param cache:       optional DefinitionCache keeping the encoding detected for the dictionary between runs
+    :param rate:        maximum number of requests per second to the dictionary host (see throttled_get)
+    :return fetch:      function taking a word and returning (final url, response text), safe to call from several threads,
+                        raises for responses other than 2xx
     """
-    definitions = {}        # holds dictionary definitions for word
-    titles = {}             # holds the new looked up word when a redirect was triggered
-                            # e.g. when the word was a conjugated verb form and the dictionary sites
-                            # redirects to the definition of the inifinitiv form, is used as "header" on cards
     baseurl = dict['url']
-    parser = 'parse_' + dict['src_lang'] + "_" + str(dict['id'])
-    parse = getattr(p, parser)
-
-    print(f'Looking up words at {baseurl}...')
-
-    detected_encoding = False
+    # encoding detected for responses of the dictionary that do not declare one, shared by all workers
+    detected = {'encoding': cache.get_encoding(dict) if cache else None}
+    detect_lock = Lock()
     logging.getLogger('chardet').setLevel(log_level)
 
-    for word in words:
+    def detect(content): # detect the encoding once per dictionary, on a bounded part of a page only
+        with detect_lock:
+            if detected['encoding'] is None:
+                start = NON_ASCII.search(content)
+                if start is None:
+                    return 'utf-8'      # plain ASCII, tells nothing about the encoding of other pages
+                import chardet
+                detected['encoding'] = chardet.detect(content[start.start():start.start() + DETECT_BYTES])['encoding'] or 'utf-8'
+                if cache:
+                    cache.put_encoding(dict, detected['encoding'])
+            return detected['encoding']
+
+    def fetch(word): # fetch the dictionary page for word, runs in a worker thread
         # determine lookup url for word
         if 'linguee' in baseurl:
             url =  baseurl + word.lower() + '.html'
         else:
             url =  baseurl + word.lower()
 
-        print(f"looking up {word} ...", end="")
+        r = throttled_get(session, url, per_host, rate)
+        if not 200 <= r.status_code < 300:
+            # not a page of the dictionary (e.g. 404): reported as a failed lookup, neither archived nor cached as a miss
+            raise HTTPError(url, r.status_code, r.reason, r.headers, None)
+        if m.metrics.enabled:
+            m.metrics.count('http/bytes', len(r.content))
+            m.metrics.count('http/wire_bytes', r.raw.tell())     # as received, before decompression
+
+        # use the encoding the response declares, detect it only if it declares none
+        with m.metrics.timed('encoding'):
+            r.encoding = declared_encoding(r.headers.get('Content-Type'), r.content) or detect(r.content)
+            text = r.text
+        if archive:
+            with m.metrics.timed('archive'):
+                archive.put(dict, word, r.url, r.content, r.encoding)
+        return r.url, text
+
+    return fetch
+
+def lookup_words(dict, words, fetch, cache=None, workers=1, parsers=0, refresh=False, recheck=False, stems=None): # fetch and parse words concurrently, shared by all dictionaries
+    """
+    :param dict:        a dictionary (data type) containing information about the 
+                        (online language) dictionary to be used for lookups
+    :param words:       the list of words to be looked up
+    :param fetch:       function taking a word and returning (final url, response text), raises on failure
+    :param cache:       optional DefinitionCache, words found there are not fetched again
+    :param workers:     number of words looked up concurrently
+    :param parsers:     number of processes parsing fetched pages (see stream_definitions)
+    :param refresh:     look up words found in the cache too, replacing their entries
+    :param recheck:     look up words known not to be found in the dictionary too
+    :param stems:       optional dictionary of the stems of words, words sharing a stem are looked up once
+    :return titles, definitions: dictionaries of card titles and definitions with looked up words as keys,
+                        in the order of words
+    """
+    definitions = {}        # holds dictionary definitions for word
+    titles = {}             # holds the new looked up word when a redirect was triggered
+                            # e.g. when the word was a conjugated verb form and the dictionary sites
+                            # redirects to the definition of the inifinitiv form, is used as "header" on cards
+    records = ({'word': word, 'stem': stems.get(word) if stems else None} for word in words)
+    for record in stream_definitions(dict, records, fetch, cache, workers, parsers, refresh, recheck):
+        if record['title'] is not None:
+            titles[record['word']] = record['title']
+        definitions[record['word']] = record['definition']
+    return titles, definitions
+
+def stream_definitions(dict, records, fetch, cache=None, workers=1, parsers=0, refresh=False, recheck=False): # look up a stream of words concurrently
+    """
+    :param dict:        a dictionary (data type) containing information about the 
+                        (online language) dictionary to be used for lookups
+    :param records:     iterable of dictionaries with the 'word' to be looked up and optionally its 'stem'
+                        (e.g. as yielded by iter_usage), consumed only as far as lookups are in flight;
+                        words with the same stem or differing in case only are looked up once (later ones
+                        are served by the cache, without one only those in flight together share a lookup),
+                        records with a definition already (e.g. found in a previous dictionary) are passed on as they are
+    :param fetch:       function taking a word and returning (final url, response text), raises on failure
+    :param cache:       optional DefinitionCache, words found there are not fetched again
+    :param workers:     number of words looked up concurrently
+    :param parsers:     number of processes parsing the fetched pages while further pages are fetched,
+                        0 to parse in the fetching threads
+    :param refresh:     look up words found in the cache too, replacing their entries (e.g. when reparsing)
+    :param recheck:     look up words known not to be found in the dictionary (cached misses) too
+    :return record:     (yields) the records in their original order with 'title' (None if the lookup failed),
+                        'definition' ('None' if none was found) and 'source' (the dictionary looked up) added
+    """
+    parser = 'parse_' + dict['src_lang'] + "_" + str(dict['id'])
+    window = deque()                            # records in flight, in order
+    bound = max(1, workers) + parsers           # ... at most that many
+    pools = {}                                  # fetch threads and parse processes, started with the first lookup
+    lookups = {}                                # normalized stem or word -> (word looked up, lookup future or its result),
+                                                # of the words in flight only
+    queue = BoundedSemaphore(bound)             # fetched pages waiting for a parse process
+    broken = Event()                            # set when a parse process died, pages are parsed in the fetching threads then
+
+    def parse_here(text, word, start): # parse a page in the calling thread
+        definition = parse_response(parser, text, word)
+        m.metrics.observe('word', time.perf_counter() - start)
+        return definition
+
+    def parse_pool_broken(err): # a parse process died (e.g. killed for lack of memory), the pool is unusable
+        if not broken.is_set():
+            broken.set()
+            print(f"a parse process died ({err}) - parsing in the fetching threads from now on")
+
+    def lookup(word): # fetch one word and parse it (or queue it for parsing), errors are confined to that word
+        start = time.perf_counter()
         try:
-            r = session.get(url, timeout=5)
+            url, text = fetch(word)
+            title = check_redirect(url, word)
+            if 'parse' not in pools or broken.is_set():
+                return title, parse_here(text, word, start)
+            queue.acquire()
+            try:
+                if m.metrics.enabled:
+                    # the parse process records on its own, see finish
+                    parsing = pools['parse'].submit(m.collect, parse_response, parser, text, word)
+                else:
+                    parsing = pools['parse'].submit(parse_response, parser, text, word)
+            except BrokenExecutor as err:
+                queue.release()
+                parse_pool_broken(err)
+                return title, parse_here(text, word, start)
         except Exception as err:
-            print(f"an error occured trying to retrieve {url}")
-            definitions[word] = 'None'
+            print(f"looking up {word} ...an error occured: {err}")
+            return None, 'None'
+
+        def parsed(future):
+            queue.release()
+            m.metrics.observe('word', time.perf_counter() - start)
+
+        parsing.add_done_callback(parsed)
+        # the page is kept until parsed, to be parsed here should the parse process die
+        return title, (parsing, text, start)
+
+    def finish(key): # wait for the lookup of a group of words to complete
+        word, lookup = lookups[key]
+        if not isinstance(lookup, Future):
+            return lookup
+        title, definition = lookup.result()
+        if isinstance(definition, tuple):
+            parsing, text, start = definition
+            try:
+                definition = parsing.result()
+                if m.metrics.enabled:
+                    definition, recorded = definition
+                    m.metrics.merge(recorded)
+            except BrokenExecutor as err:
+                parse_pool_broken(err)
+                try:
+                    definition = parse_here(text, word, start)
+                except Exception as err:
+                    print(f"looking up {word} ...an error occured: {err}")
+                    title, definition = None, 'None'
+            except Exception as err:
+                print(f"looking up {word} ...an error occured: {err}")
+                title, definition = None, 'None'
+        if title is None:
+            pass
+        elif definition == 'None':
+            print(f"looking up {word} ...not found")
+            if cache:
+                with m.metrics.timed('cache'):
+                    cache.put_miss(dict, word)
         else:
-            # detect encoding
-            if not detected_encoding:
-                detected_encoding = chardet.detect(r.content)['encoding']
-            r.encoding = detected_encoding if detected_encoding else 'utf-8'
-            titles[word] = check_redirect(r.url, word)
-            definitions[word] = parse(r.text, word) # word is not used in all parser functions but we submit it for good measure
-
-        if definitions[word] == 'None':
-            print('not found')
+            print(f"looking up {word} ...success")
+            if cache:
+                with m.metrics.timed('cache'):
+                    cache.put(dict, word, title, definition)
+        lookups[key] = word, (title, definition)
+        return title, definition
+
+    def complete(record, key): # add the outcome of its group's lookup to a record
+        if key is None:
+            return record
+        title, record['definition'] = finish(key)
+        # the result is kept only while words of its group are in flight: further words of the group are served
+        # by the cache (which finish stored it in) or, without a cache, looked up again
+        if not any(queued == key for _, queued in window):
+            del lookups[key]
+        # a card is titled with the entry it shows: its own word only if that is the entry up to case, not if the word
+        # was looked up as its stem or the dictionary redirected the lookup to the entry of another word
+        if title is not None and c.normalize(title) == c.normalize(record['word']):
+            title = record['word']
+        record['title'] = title
+        record['source'] = dict
+        return record
+
+    try:
+        for record in records:
+            if record.get('definition', 'None') != 'None':
+                window.append((record, None))
+                continue
+            # inflected forms and case variants of a word share one lookup (of the stem, if Kindle recorded one)
+            word = record.get('stem') or record['word']
+            key = c.normalize(word)
+            if key in lookups:
+                m.metrics.count('words/shared')
+            else:
+                # serve from cache what we looked up before, the rest is fetched concurrently
+                with m.metrics.timed('cache'):
+                    cached = cache.get(dict, word) if cache and not refresh else None
+                    missing = not cached and cache and not (refresh or recheck) and cache.is_miss(dict, word)
+                if cached:
+                    print(f"looking up {word} ...cached")
+                    m.metrics.count('cache/hits')
+                    lookups[key] = word, cached
+                elif missing:
+                    # known not to be in the dictionary, no need to fetch it again
+                    print(f"looking up {word} ...not found (cached)")
+                    m.metrics.count('cache/known_misses')
+                    lookups[key] = word, (word, 'None')     # a title: not found, unlike a failed lookup
+                else:
+                    m.metrics.count('cache/lookups')
+                    if 'fetch' not in pools:
+                        pools['fetch'] = ThreadPoolExecutor(max_workers=max(1, workers), initializer=m.metrics.profile_thread)
+                        if parsers > 0:
+                            from concurrent.futures import ProcessPoolExecutor
+                            import k2a_response_parsers as p
+                            # the processes start with the parse backend chosen here
+                            pools['parse'] = ProcessPoolExecutor(max_workers=parsers, mp_context=process_context(),
+                                                                 initializer=p.set_backend, initargs=(p.backend,))
+                    lookups[key] = word, pools['fetch'].submit(lookup, word)
+            window.append((record, key))
+            # hand on completed records in order, keeping no more than bound in flight
+            while window and (len(window) >= bound or window[0][1] is None or not isinstance(lookups[window[0][1]][1], Future)):
+                yield complete(*window.popleft())
+        while window:
+            yield complete(*window.popleft())
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+
+def process_context(): # how worker processes are started
+    """
+    :return context:    multiprocessing context starting processes from a fork server (or spawning them where there
+                        is none): they are started while other threads run (fetch threads, session warm-ups), and a
+                        process forked from the running program could inherit a lock one of them holds and hang
+    """
+    import multiprocessing
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def stream_chain(dicts, records, fetches, cache=None, workers=1, parsers=0, refresh=False, recheck=False, merge=False): # look up a stream of words in several dictionaries
+    """
+    :param dicts:       list of dictionaries (data type) to be used for lookups, in order
+    :param records:     iterable of dictionaries with the 'word' to be looked up (see stream_definitions)
+    :param fetches:     list of fetch functions, one per dictionary (see dictionary_fetches)
+    :param merge:       False: a word is looked up in the next dictionary only if the previous ones lack it
+                        (as soon as that is known, while further words are looked up in the previous ones),
+                        True: all words are looked up in all dictionaries at once and their definitions merged
+    :return record:     (yields) the records in their original order with 'title', 'definition' and 'source' added,
+                        'source' is the first dictionary that had the word
+    (see stream_definitions for the other parameters, the parse processes are shared out among the dictionaries)
+    """
+    parsers = max(1, parsers // len(dicts)) if parsers else 0
+    for dict, fetch in zip(dicts, fetches):
+        if merge:
+            records = shelve(records)
+        records = stream_definitions(dict, records, fetch, cache, workers, parsers, refresh, recheck)
+    return merged(shelve(records)) if merge and len(dicts) > 1 else records
+
+def shelve(records): # set the definitions found so far aside, so that the next dictionary looks up every word
+    for record in records:
+        if 'definition' in record:
+            record.setdefault('found', [])
+            if record['definition'] != 'None':
+                record['found'].append((record['source'], record['title'], record.pop('definition')))
+            else:
+                del record['definition']
+        yield record
+
+def merged(records): # merge the definitions set aside by shelve into one
+    for record in records:
+        found = record.pop('found', [])
+        if not found:
+            record['title'], record['definition'] = record.get('title'), 'None'
         else:
-            print('success') 
+            record['source'], record['title'] = found[0][0], found[0][1]
+            record['definition'] = '\n\n'.join(f"{dict['name']} ({dict['desc'].strip()}):\n{definition}" for dict, _, definition in found)
+        yield record
 
-    return titles, definitions
+def parse_response(parser, text, word): # parse a dictionary page, runs in a parse process or a fetching thread
+    """
+    :param parser:      name of the parser function in k2a_response_parsers ('parse_<lang>_<id>')
+    :param text:        the response text (or bytes)
+    :param word:        the looked-up word
+    :return parsed:     the definitions parsed from the page, 'None' if none were found
+    """
+    import k2a_response_parsers as p
+    with m.metrics.timed(f'parse/{parser}'):
+        return getattr(p, parser)(text, word) # word is not used in all parser functions but we submit it for good measure
+
+def host_throttle(url, rate=t.DEFAULT_RATE, burst=1): # get the throttle of the host of url
+    """
+    :param url:         URL about to be requested
+    :param rate:        maximum number of requests per second to the host (applies when the host is first seen)
+    :param burst:       number of requests that may be sent at once (applies when the host is first seen)
+    :return throttle:   the HostThrottle shared by all requests to that host
+    """
+    host = urlsplit(url).netloc
+    with host_slots_lock:
+        if host not in host_throttles:
+            host_throttles[host] = t.HostThrottle(host, rate, burst)
+        return host_throttles[host]
+
+def throttled_get(session, url, per_host, rate): # request url, adapting to the load the host signals
+    """
+    :param session:     the request session object to be used for get requests
+    :param url:         URL to be requested
+    :param per_host:    maximum number of concurrent requests to the host
+    :param rate:        maximum number of requests per second to the host
+    :return response:   the response, raises if the host kept failing
+                        (overloaded or unreachable, each attempt waits for the host to recover first;
+                        failures of the host as a whole, e.g. while it is paused, do not use up the attempts)
+    """
+    import requests
+    throttle = host_throttle(url, rate, per_host)
+    start = time.perf_counter()
+    attempts = 0
+    while attempts < t.MAX_ATTEMPTS:
+        sent = throttle.acquire()
+        m.metrics.count('http/requests')
+        try:
+            with host_slot(url, per_host), m.metrics.timed('http'):
+                r = session.get(url, timeout=5)
+        except requests.RequestException as err:
+            m.metrics.count('http/errors')
+            error = err
+            pause, opened, counted = throttle.failure(throttled=False, sent=sent)
+        else:
+            if r.status_code in t.THROTTLE_STATUS:
+                m.metrics.count('http/throttled')
+                pause, opened, counted = throttle.failure(t.retry_after(r.headers.get('Retry-After')), sent=sent)
+            elif r.status_code >= 500 or r.status_code in t.REFUSED_STATUS:
+                # the host is failing (or refusing us): retried like a connection error, counts towards the circuit
+                m.metrics.count('http/errors')
+                pause, opened, counted = throttle.failure(throttled=False, sent=sent)
+            else:
+                throttle.success()
+                m.metrics.observe('request', time.perf_counter() - start)
+                return r
+            error = HTTPError(url, r.status_code, r.reason, r.headers, None)
+        if opened:
+            print(f"{throttle.host} keeps failing ({error}) - pausing it for {pause:.0f}s ...")
+        attempts += counted
+    raise error
 
-def check_redirect(url, word):
+def host_slot(url, limit): # get the semaphore bounding concurrent requests to the host of url
+    """
+    :param url:         URL about to be requested
+    :param limit:       maximum number of concurrent requests to the host (applies when the host is first seen)
+    :return semaphore:  a semaphore shared by all requests to that host, to be used as context manager
+    """
+    host = urlsplit(url).netloc
+    with host_slots_lock:
+        if host not in host_slots:
+            host_slots[host] = BoundedSemaphore(max(1, limit))
+        return host_slots[host]
+
+def check_redirect(url, word): # the word whose entry a lookup ended up at
+    """
+    :param url:     the final url of the lookup (after redirects)
+    :param word:    the looked-up word
+    :return title:  the word of the entry Larousse redirected the lookup to (.../<lemma>/<entry id>),
+                    else the looked-up word
+    """
     if "larousse" in url.lower():
-        return unquote(url.split("/")[-2])
-    else:
-        return word
+        segments = urlsplit(url).path.rstrip("/").split("/")
+        if len(segments) > 1 and segments[-1].isdigit():
+            return unquote(segments[-2])
+    return word
 
-def get_definitions_rae(words, log_level):  # custom get_definitions function for "rae" since our standard connect method did not work
+def declared_encoding(content_type, content): # encoding declared by a response
     """
-    :param dict:        a dictionary (data type) containing information about the 
-                        (online language) dictionary to be used for lookups
-    :param words:       the list of words to be looked up    
-    :return definitions: a dictionary of definitions with looked up words as keys
+    :param content_type:    Content-Type header of the response (or None)
+    :param content:         the response body (bytes)
+    :return encoding:       the charset of the Content-Type header, else of a meta tag at the top of the page,
+                            None if neither declares a known encoding
     """
+    candidates = []
+    if content_type:
+        candidates.append(CHARSET.search(content_type))
+    candidates.append(META_CHARSET.search(content[:META_BYTES]))
+    for match in candidates:
+        if match:
+            charset = match.group(1)
+            charset = charset.decode('ascii', errors='ignore') if isinstance(charset, bytes) else charset
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                continue
+    return None
+
+def make_fetch_rae(log_level, per_host=DEFAULT_PER_HOST, archive=None, rate=t.DEFAULT_RATE): # create the function fetching RAE entries through pyrae
+    """
+    :param log_level:   log level for the pyrae module
+    :param per_host:    maximum number of concurrent requests to dle.rae.es
+    :param archive:     optional ResponseArchive every entry is stored in
+    :param rate:        maximum number of requests per second to dle.rae.es
+    :return fetch:      function taking a word and returning (url, entry html)
+    """
+    from pyrae import dle
     dle.set_log_level(log_level)
-    definitions = {}
-    parser = 'parse_es_1'
-    parse = getattr(p, parser)
+    rae = d.get_dictionaries('es')[0]
 
-    for word in words:
-        # base url is encoded in dle module
-        print(f'looking up {word} ...', end="")
-        try:
+    def fetch(word): # base url is encoded in dle module, which handles the connection
+        host_throttle(rae['url'], rate, per_host).acquire()
+        m.metrics.count('http/requests')
+        with host_slot(rae['url'], per_host), m.metrics.timed('http'):
             r = dle.search_by_word(word = f'{word}')
-        except Exception as err:
-            print(f"an error occured trying to retrieve dle dictionary entry for {word}")
-            definitions[word] = 'None'
-        else:
-            r.encoding = 'utf-8'  # Explicitly set the encoding to utf-8
-            definitions[word] = parse(r._html)
-            if definitions[word] == 'None':
-                print('not found')
-            else:
-                print('success')
-    return definitions
+        if r is None:
+            raise LookupError(f"no dle dictionary entry retrieved for {word}")
+        if m.metrics.enabled:
+            m.metrics.count('http/bytes', len(r._html.encode('utf-8')))
+        if archive:
+            archive.put(rae, word, rae['url'], r._html.encode('utf-8'), 'utf-8')
+        return rae['url'], r._html
+
+    return fetch
+
+def make_fetch_archive(dict, archive): # create the function reading archived responses instead of fetching them
+    """
+    :param dict:        a dictionary (data type) containing information about the 
+                        (online language) dictionary the responses were archived for
+    :param archive:     the ResponseArchive to read from
+    :return fetch:      function taking a word and returning (final url, response text) as archived
+    """
+    def fetch(word): # raises for words never archived, they are reported like failed lookups
+        entry = archive.get(dict, word)
+        if entry is None:
+            raise LookupError(f"no archived response for {word}")
+        return entry
+
+    return fetch
 
-def highlight(definition, word, card_type, lang): # highlight occurences of the word in bold-face
+def highlight(definition, word, card_type, lang, stem=None): # highlight occurences of the word in bold-face
     """
     :param definition:     text response from the original lookup query to the mapped french language online dictionary 
     :param word:           the word looked up in dictionary
     :param card_type:      the selected card type determines replacemnt patterns
     :param lang:           the language of the looked-up word (determines suffixes to be considered in pattern matching for highlighting)
+    :param stem:           the stem of the word as recorded by Kindle, variations are derived from it if given
     :return definition:    the text with occurrences of word (including gramatically modified forms) hightlighted in bold-face
     """
+    # this is a special for the Portuguese Michaelis Dicitionary
+    # they include sillable separated spelling (like 'sel·va·gem')
+    # which would give away the word (would not be caught by the regex
+    # a few lines down (replacing the word by (...) unless we remove it 
+    if card_type == 'B':
+        definition = SYLLABLES.sub(r'', definition)
+
+    # hightlight patterns, for card type 'B' replace the word by (...)
+    if card_type == 'A':
+        r = r'\1<b>\2</b>\3'
+    else:
+        r = r'\1<b>(...)</b>\3'
+    for pattern in highlight_patterns(word, lang, stem):
+        definition = pattern.sub(r, definition)
+
+    return definition
+
+def inflections(word, lang): # guess grammatical variations of a word
+    """
+    :param word:        the word looked up in dictionary
+    :param lang:        the language of the looked-up word (determines the suffixes considered)
+    :return patterns:   list of the word and its variations, most specific first
+    """
     # we want to catch not only the looked up word verbatim but also grammatical variations 
     # (e.g. as per number, gender or conjugation) that are frequent in many languages
-    # the following dictionary of suffix lists (one list per language), is unfortunately a 
-    # config item (though eventually a static one) hard coded in this function
     patterns = [word]
-    s = {
-        'en': ['s', 'ed', 'er', 'ing', 'ly'],
-        'fr': ['s', 'e', 'es', 'er', 'eur', 'euse', 'aux', 'il', 'ille', 'eux', 'x','t', 'te', 'ent' , 'is' ,'it', 'ons', 'ont','ment'],
-        'es': ['s','o','a','os','as','ir','er','ar','í','ó','é','aron','se','ieron','amos','imos','emos','eis','ais','mente','aba'],
-        'pt': ['s','ir','er','ar','a','o','al','este','amos','emos','imos','ou','ei','i','ão','ões','aste','aram','eram','mente','ava'],
-        'de': ['e','st','er','s','t','d','en','ig','lich','ung','keit'],
-    }
-    suffixes = s[lang]
+    suffixes = SUFFIXES[lang]
     has_suffix = False
     for s1 in suffixes:
         # add patterns with suffix removed from word
@@ -384,24 +1293,47 @@ def highlight(definition, word, card_type, lang): # highlight occurences of the
     if has_suffix == False:
         for s in suffixes:
             patterns.append(word + s)    
+    return patterns
 
-    # this is a special for the Portuguese Michaelis Dicitionary
-    # they include sillable separated spelling (like 'sel·va·gem')
-    # which would give away the word (would not be caught by the regex
-    # a few lines down (replacing the word by (...) unless we remove it 
-    if card_type == 'B':
-        definition = re.sub(r'(\b\w+·){1,}\w+\b',r'', definition)
-
-    # hightlight patterns, for card type 'B' replace the word by (...)
-    for pattern in patterns:
-        p = rf'(^|\s?)({pattern})(\s|\.|\,|:|\?|$)'
-        if card_type == 'A':
-            r = r'\1<b>\2</b>\3'
-        else:
-            r = r'\1<b>(...)</b>\3'
-        definition = re.sub(p, r, definition, flags=re.IGNORECASE)
+def lemma_forms(word, stem, lang): # derive grammatical variations of a word from its stem
+    """
+    :param word:        the word looked up in dictionary
+    :param stem:        the stem of the word (e.g. the infinitive of a conjugated verb)
+    :param lang:        the language of the looked-up word (determines the suffixes considered)
+    :return patterns:   list of the word, its stem and the stem's variations, longest first
+    """
+    # strip the longest suffix from the stem and attach all others to that one root instead of
+    # guessing roots from each suffix the (possibly irregular) surface form happens to end in
+    suffixes = SUFFIXES[lang]
+    root = stem
+    for suffix in sorted(suffixes, key=len, reverse=True):
+        if stem.endswith(suffix) and len(suffix) < len(stem):
+            root = stem[:-len(suffix)]
+            break
+    # longest first, so that a variation is preferred over a shorter one it ends in (and one pass over the text suffices)
+    return sorted([word, stem] + [root + suffix for suffix in suffixes], key=len, reverse=True)
 
-    return definition
+@lru_cache(maxsize=4096)
+def highlight_patterns(word, lang, stem=None): # compile the regular expressions highlighting a word, memoized per word, language and stem
+    """
+    :param word:        the word looked up in dictionary
+    :param lang:        the language of the looked-up word
+    :param stem:        the stem of the word, variations are guessed from the word alone if missing
+    :return patterns:   tuple of compiled patterns to be applied in turn, capturing (leading space)(variation)(delimiter)
+    """
+    variations = lemma_forms(word, stem, lang) if stem else inflections(word, lang)
+    patterns = list({pattern: None for pattern in variations})   # without duplicates, in order
+    # one alternation matches all variations in a single pass over the text; it finds the same matches as applying
+    # the variations one after another as long as no variation ends in one listed earlier (the alternation would prefer
+    # the longer one starting further left) and all are plain words (no regex syntax, no empty root)
+    single_pass = all(pattern.isalnum() and pattern.lower() == pattern.casefold() for pattern in patterns)
+    if single_pass:
+        folded = [pattern.lower() for pattern in patterns]
+        single_pass = not any(later != earlier and later.endswith(earlier)
+                              for i, earlier in enumerate(folded) for later in folded[i + 1:])
+    if single_pass:
+        patterns = ['|'.join(patterns)]
+    return tuple(re.compile(rf'(^|\s?)({pattern})(\s|\.|\,|:|\?|$)', flags=re.IGNORECASE) for pattern in patterns)
 
 def is_happy(selection): # make sure user is happy with a menu selection 
     """
@@ -421,74 +1353,64 @@ def is_happy(selection): # make sure user is happy with a menu selection
         case 'n'|'N'|'no'|'NO':
             return False
 
-def connect(url, referer, log_level): # initiate https connection to online dictionary
-    """
-    :param url:         dicionary URL 
-    :log_level:         log level for session logging
-    :return session:    request session object
-    """
-    logging.getLogger("requests").setLevel(log_level)
-    logging.getLogger("urllib3").setLevel(log_level)
-    adapter = HTTPAdapter(max_retries=5)
-    session = requests.Session()
-    session.mount(url, adapter)
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': referer,
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Connection': 'keep-alive'
-    }
-
-    try:
-        r = session.get(
-            url,
-            timeout = (3, 5),
-            headers = headers,
-            allow_redirects=True
-        )
-        r.raise_for_status()
-    except RetryError as err:
-        print(f"Error: {err}")
-    except HTTPError as http_err:
-        print(f"a https error occured: {http_err}")
-    except Exception as err:
-        print(f"some error occured: {err}")
-    else:
-        print(f"Successfully connected to {url}")
-
-    return session
-
-def create_deck(deckname): # create a card deck
+def create_deck(deckname, book=None, dict=None, card_type=None): # create a card deck
     """
     :param deckname:    name of the card deck to be created
+    :param book:        the book the deck is created for
+    :param dict:        the dictionary object used
+    :param card_type:   the card type selected (A or B)
     :return deck:       card deck object
     """
-    # Generate a unique deck ID using deck name and timestamp
-    unique_string = 'k2a' + str(datetime.now())  # Combine deck name with the current timestamp
-    deck_id = int(hashlib.md5(unique_string.encode('utf-8')).hexdigest(), 16) >> 96
-
+    import genanki
     deck = genanki.Deck(
-        deck_id,
+        deck_id(book, dict, card_type, deckname),
         deckname
     )
     print(f'Creating card deck {deckname}')
     return deck
 
-def create_cards(deck, dict, card_type, words, usage, titles, definitions): # write cards to card deck 
+def deck_id(book, dict, card_type, deckname=None): # stable id of the deck of a book, dictionary and card type
     """
-    :param deck:            the card deck object that accomodates the cards to be created
-    :param dict:            the dictionary object used
-    :param card_type:       the card type selected (A or B) 
-    :param words:           array of words for which cards are to be created
-    :param usage:           a dictionary object containing the text passages from which words had been looked up in Kindle 
-    :param definitions:     the dictionary definitions looked up for each word
-    :param titles:          the "title" word for cards (may be the inifinitiv if the word was a conjugated verb form)       
-    :return deck_is_empty:  Boolean: True if no cards were added, Falls if deck contains cards 
+    :param book:        the book the deck is created for (None to derive the id from the deck name)
+    :param dict:        the dictionary object used
+    :param card_type:   the card type selected (A or B)
+    :param deckname:    name of the card deck, used if no book is given
+    :return id:         the deck id: rebuilding a deck updates the deck in Anki instead of creating a new one,
+                        and incremental syncs are kept per deck id
+    """
+    if book:
+        unique_string = '::'.join(('k2a', book['id'], dict['src_lang'], str(dict['id']), card_type))
+    else:
+        unique_string = 'k2a' + deckname
+    return int(hashlib.md5(unique_string.encode('utf-8')).hexdigest(), 16) >> 96
+
+def read_notes(deckname): # read the notes of a previously written card deck
     """
-    # Define the basic card model (Front/Back flashcard)
-    basic_model = genanki.Model(
+    :param deckname:    name of the apkg file
+    :return notes:      a dictionary with note GUIDs as keys and the list of note fields as values,
+                        empty if the file does not exist
+    """
+    if not path.exists(deckname):
+        return {}
+    import tempfile
+    import zipfile
+    with zipfile.ZipFile(deckname) as apkg, tempfile.TemporaryDirectory() as tmp:
+        names = apkg.namelist()
+        collection = 'collection.anki21' if 'collection.anki21' in names else 'collection.anki2'
+        apkg.extract(collection, tmp)
+        conn = sqlite3.connect(path.join(tmp, collection))
+        try:
+            notes = {guid: flds.split('\x1f') for guid, flds in conn.execute("SELECT guid, flds FROM notes")}
+        finally:
+            conn.close()
+    return notes
+
+def card_model(): # the basic card model (Front/Back flashcard) used for all cards
+    """
+    :return model:  genanki model object
+    """
+    import genanki
+    return genanki.Model(
         1149758716, # was generated with random.randrange(1 << 30, 1 << 31)
         'Simple Model',
         fields = [
@@ -511,23 +1433,52 @@ def create_cards(deck, dict, card_type, words, usage, titles, definitions): # wr
         }
         """  # Custom CSS controlling font size and other styles
     )
+
+def create_cards(deck, dict, card_type, words, usage, titles, definitions, stems=None): # write cards to card deck 
+    """
+    :param deck:            the card deck object that accomodates the cards to be created
+    :param dict:            the dictionary object used
+    :param card_type:       the card type selected (A or B) 
+    :param words:           array of words for which cards are to be created
+    :param usage:           a dictionary object containing the text passages from which words had been looked up in Kindle 
+    :param definitions:     the dictionary definitions looked up for each word
+    :param titles:          the "title" word for cards (may be the inifinitiv if the word was a conjugated verb form)       
+    :param stems:           optional stems of the words (WORDS.stem), highlighting is driven by them if given
+    :return has_cards:      Boolean: True if cards were added, False if no cards were added
+    """
+    records = ({'word': word, 'usage': usage[word], 'stem': stems.get(word) if stems else None,
+                'title': titles.get(word), 'definition': definitions[word]} for word in words)
+    return add_cards(deck, dict, card_type, records)
+
+def add_cards(deck, dict, card_type, records): # add cards to the card deck as the looked-up words come in
+    """
+    :param deck:            the card deck object that accomodates the cards to be created
+    :param dict:            the dictionary object used
+    :param card_type:       the card type selected (A or B) 
+    :param records:         iterable of looked-up words (e.g. as yielded by stream_definitions), dictionaries with the 'word',
+                            its 'usage' (text passage from Kindle), 'stem' (or None), card 'title' and 'definition'
+    :return has_cards:      Boolean: True if cards were added, False if no cards were added
+    """
+    import genanki
+    basic_model = card_model()
     # iterate over words to to create cards and add the to the deck ...
 
     has_cards = False
-    for word in words:
-        if definitions[word] == 'None':
+    for record in records:
+        word = record['word']
+        if record['definition'] == 'None':
             print(f"no definition found for {word} - skipping ...")
             continue
         else:
             print(f"Adding card for {word} ...")
             #htmlify '\n' in definitions and highlight word occurences in bold-face
-            title = titles[word]
-            definition = highlight(definitions[word].replace('\n','<br>'), word, card_type, dict['src_lang'])
-            #definition = highlight(definitions[word], word, card_type, dict['src_lang'])
+            title = record['title']
+            with m.metrics.timed('highlight'):
+                definition = highlight(record['definition'].replace('\n','<br>'), word, card_type, dict['src_lang'], record.get('stem'))
             definition = re.sub(r" {2,}", "\xa0", definition)
 
             # htmlify '\n' in text passage
-            passage = usage[word].replace('\n','<br>')
+            passage = record['usage'].replace('\n','<br>')
             passage = re.sub(r" {2,}", lambda match: "&nbsp;" * len(match.group()), passage)
 
             # define front and back depending on card type and highlight occurrences of word
@@ -540,13 +1491,15 @@ def create_cards(deck, dict, card_type, words, usage, titles, definitions): # wr
                 front = definition
                 back = f"<b>{title}</b><br><br>{passage}" 
         
-            # create card for word
-            card = genanki.Note(
-                model = basic_model,
-                fields=[front, back])
+            # create card for word, its GUID is stable per deck and word so that a rebuilt deck updates the note
+            with m.metrics.timed('notes'):
+                card = genanki.Note(
+                    model = basic_model,
+                    fields=[front, back],
+                    guid = genanki.guid_for(deck.deck_id, word))
 
-            # add card to deck
-            deck.add_note(card)
+                # add card to deck
+                deck.add_note(card)
             has_cards = True
 
     return has_cards
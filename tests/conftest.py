@@ -0,0 +1,4 @@
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.realpath(__file__)), '..'))
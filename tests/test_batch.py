@@ -0,0 +1,58 @@
+# tests of the batch specs (kindle2anki.load_batch and run_batch)
+#
+import json
+
+import pytest
+
+import kindle2anki as k
+
+BOOKS = [{'id': 'carol', 'asin': 'B000', 'lang': 'en', 'title': 'A Christmas Carol', 'last_lookup': 1000},
+         {'id': 'carol2', 'asin': 'B001', 'lang': 'en', 'title': 'A Christmas Carol', 'last_lookup': 2000}]
+
+def write(tmp_path, name, text):
+    file = tmp_path / name
+    file.write_text(text, encoding='utf-8')
+    return str(file)
+
+def test_json_spec(tmp_path):
+    spec = {'defaults': {'dictionary': 1, 'card_type': 'A'},
+            'decks': [{'book': 'B000'}, {'book': 'carol', 'dictionary': [1, 2], 'merge': True, 'deck': 'carol'}]}
+    assert k.load_batch(write(tmp_path, 'spec.json', json.dumps(spec))) == spec
+
+def test_toml_spec(tmp_path):
+    file = write(tmp_path, 'spec.TOML', """
+[defaults]
+dictionary = 1
+card_type = "A"
+
+[[decks]]
+book = "B000"
+
+[[decks]]
+book = "christmas carol"
+card_type = "B"
+deck = "carol"
+""")
+    assert k.load_batch(file) == {'defaults': {'dictionary': 1, 'card_type': 'A'},
+                                  'decks': [{'book': 'B000'}, {'book': 'christmas carol', 'card_type': 'B', 'deck': 'carol'}]}
+
+@pytest.mark.parametrize('spec, error', [
+    ('{"decks": []}', 'lists no decks'),
+    ('{"decks": [{"book": "B000", "card_type": "A"}]}', "'dictionary' missing"),
+    ('{"decks": [{"book": "B000", "dictionary": "one", "card_type": "A"}]}', 'invalid dictionary'),
+    ('{"decks": [{"book": "B000", "dictionary": 1, "card_type": "C"}]}', 'invalid card type'),
+    ('{"defaults": {"deck": "all"}, "decks": [{"book": "B000", "dictionary": 1, "card_type": "A"}]}', 'cannot be a default'),
+    ('{"decks": [', 'cannot read'),
+])
+def test_invalid_spec(tmp_path, spec, error):
+    with pytest.raises(SystemExit) as exited:
+        k.load_batch(write(tmp_path, 'spec.json', spec))
+    assert error in str(exited.value)
+
+def test_deck_name_of_several_books(tmp_path, monkeypatch):
+    monkeypatch.setattr(k, 'get_books', lambda db, vdb=None, cache=None: BOOKS)
+    spec = k.load_batch(write(tmp_path, 'spec.json', json.dumps(
+        {'decks': [{'book': 'christmas carol', 'dictionary': 1, 'card_type': 'A', 'deck': 'carol'}]})))
+    with pytest.raises(SystemExit) as exited:
+        k.run_batch(None, spec, {'vdb': None, 'incremental': False})
+    assert 'matches 2 books' in str(exited.value)
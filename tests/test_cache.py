@@ -0,0 +1,136 @@
+# tests of the definition cache (k2a_cache) and of the redirect titles it keys aliases on
+#
+import time
+
+import pytest
+
+import k2a_cache as c
+import kindle2anki as k
+
+FRENCH = {'src_lang': 'fr', 'id': 1, 'url': 'https://www.larousse.fr/dictionnaires/francais/'}
+ENGLISH = {'src_lang': 'en', 'id': 1, 'url': 'https://www.merriam-webster.com/dictionary/'}
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = c.DefinitionCache(str(tmp_path / 'cache.db'))
+    yield cache
+    cache.close()
+
+def aliases(cache):
+    return cache.db.execute("SELECT word, lemma FROM aliases ORDER BY word").fetchall()
+
+def test_put_get(cache):
+    cache.put(ENGLISH, 'house', 'house', 'a building')
+    assert cache.get(ENGLISH, 'house') == ('house', 'a building')
+    assert cache.get(ENGLISH, 'House ') == ('house', 'a building')
+    assert cache.get(ENGLISH, 'mouse') is None
+    assert cache.get(FRENCH, 'house') is None
+    assert aliases(cache) == []
+
+def test_put_replaces(cache):
+    cache.put(ENGLISH, 'house', 'house', 'a building')
+    cache.put(ENGLISH, 'house', 'house', 'a home')
+    assert cache.get(ENGLISH, 'house') == ('house', 'a home')
+
+def test_redirect_alias(cache):
+    cache.put(FRENCH, 'mangeait', 'manger', 'prendre un repas')
+    assert aliases(cache) == [('mangeait', 'manger')]
+    assert cache.get(FRENCH, 'mangeait') == ('manger', 'prendre un repas')
+    # the entry serves its lemma too, and other words once their alias is known
+    assert cache.get(FRENCH, 'manger') == ('manger', 'prendre un repas')
+    cache.put(FRENCH, 'mangeons', 'manger', 'prendre un repas')
+    assert cache.get(FRENCH, 'mangeons') == ('manger', 'prendre un repas')
+
+def test_words_not_redirected_are_kept_apart(cache):
+    for word, definition in (('maison', 'bâtiment'), ('chat', 'félin')):
+        url = FRENCH['url'] + word      # Larousse answered without redirecting
+        cache.put(FRENCH, word, k.check_redirect(url, word), definition)
+    assert aliases(cache) == []
+    assert cache.get(FRENCH, 'maison') == ('maison', 'bâtiment')
+    assert cache.get(FRENCH, 'chat') == ('chat', 'félin')
+
+def test_alias_dropped_when_no_longer_redirected(cache):
+    cache.put(FRENCH, 'mangeait', 'manger', 'prendre un repas')
+    cache.put(FRENCH, 'mangeait', 'mangeait', 'forme de manger')
+    assert aliases(cache) == []
+    assert cache.get(FRENCH, 'mangeait') == ('mangeait', 'forme de manger')
+
+def test_expired(tmp_path):
+    cache = c.DefinitionCache(str(tmp_path / 'cache.db'), ttl=-1)
+    cache.put(ENGLISH, 'house', 'house', 'a building')
+    assert cache.get(ENGLISH, 'house') is None
+    cache.close()
+
+def test_misses(cache):
+    assert not cache.is_miss(ENGLISH, 'xyzzy')
+    cache.put_miss(ENGLISH, 'xyzzy')
+    assert cache.is_miss(ENGLISH, 'Xyzzy')
+    assert not cache.is_miss(FRENCH, 'xyzzy')
+    # a word found after all is no miss any more
+    cache.put(ENGLISH, 'xyzzy', 'xyzzy', 'a magic word')
+    assert not cache.is_miss(ENGLISH, 'xyzzy')
+
+def test_evict_drops_orphaned_aliases(tmp_path):
+    cache = c.DefinitionCache(str(tmp_path / 'cache.db'), max_size=10)
+    cache.put(FRENCH, 'mangeait', 'manger', 'prendre un repas')
+    time.sleep(0.01)
+    cache.put(FRENCH, 'chat', 'chat', 'félin')
+    assert cache.evict() == 1
+    assert cache.get(FRENCH, 'mangeait') is None
+    assert aliases(cache) == []
+    assert cache.get(FRENCH, 'chat') == ('chat', 'félin')
+    cache.close()
+
+@pytest.mark.parametrize('url, title', [
+    ('https://www.larousse.fr/dictionnaires/francais/maison', 'chat'),
+    ('https://www.larousse.fr/dictionnaires/francais/maison/48829', 'maison'),
+    ('https://www.larousse.fr/dictionnaires/francais/mang%C3%A9/48829#sens', 'mangé'),
+    ('https://www.merriam-webster.com/dictionary/run', 'chat'),
+])
+def test_check_redirect(url, title):
+    assert k.check_redirect(url, 'chat') == title
+
+class Response: # a response to a lookup, decoded with the encoding set on it (as by requests)
+    def __init__(self, url, content, content_type):
+        self.status_code = 200
+        self.url = url
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+        self.encoding = None
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+class Session:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url, timeout=None):
+        return Response(url, *self.pages[url.rsplit('/', 1)[1]])
+
+def test_declared_encoding():
+    page = 'café'.encode('cp1252')
+    assert k.declared_encoding('text/html; charset=ISO-8859-1', page) == 'iso8859-1'
+    assert k.declared_encoding('text/html', b'<html><head><meta charset="windows-1252">' + page) == 'cp1252'
+    assert k.declared_encoding('text/html; charset="utf-8"', b'<meta charset="windows-1252">') == 'utf-8'
+    assert k.declared_encoding('text/html; charset=unknown', page) is None
+    assert k.declared_encoding(None, page) is None
+
+def test_detected_encoding_expires(tmp_path):
+    text = ' '.join(['la maison était très éloignée, près de la forêt où régnait le silence'] * 20)
+    session = Session({'maison': (text.encode('cp1252'), 'text/html'), 'forêt': (text.encode('utf-8'), 'text/html; charset=utf-8')})
+    cache = c.DefinitionCache(str(tmp_path / 'cache.db'), ttl=60)
+    fetch = k.make_fetch(session, FRENCH, 'ERROR', cache=cache, rate=1000)
+    # declared: nothing to detect
+    assert fetch('forêt')[1] == text
+    assert cache.get_encoding(FRENCH) is None
+    # detected once per dictionary and kept for the TTL
+    assert 'éloignée' in fetch('maison')[1]
+    encoding = cache.get_encoding(FRENCH)
+    assert encoding is not None
+    cache.db.execute("UPDATE detected_encodings SET detected = detected - 120")
+    assert cache.get_encoding(FRENCH) is None
+    cache.evict()
+    assert cache.db.execute("SELECT COUNT(*) FROM detected_encodings").fetchone()[0] == 0
+    cache.close()
@@ -0,0 +1,42 @@
+# tests of the incremental sync state (k2a_state)
+#
+import json
+
+import k2a_state as st
+import kindle2anki as k
+
+BOOK = {'id': 'carol', 'last_lookup': 1000}
+ENGLISH = {'src_lang': 'en', 'id': 1}
+
+def test_decks_of_a_book_are_synced_on_their_own(tmp_path):
+    file = str(tmp_path / 'state.json')
+    state = st.load_state(file)
+    a, b = k.deck_id(BOOK, ENGLISH, 'A'), k.deck_id(BOOK, ENGLISH, 'B')
+    assert a != b
+    assert st.since(state, a, 'sum') is None
+    st.mark(state, a, BOOK, 'sum')
+    st.save_state(file, state)
+
+    state = st.load_state(file)
+    assert st.since(state, a, 'sum') is False        # vocab.db unchanged
+    assert st.since(state, a, 'other') == 1000       # lookups after the last one synced
+    assert st.since(state, b, 'sum') is None         # the other card type was never synced
+
+def test_state_per_book_is_dropped(tmp_path):
+    file = tmp_path / 'state.json'
+    file.write_text(json.dumps({'books': {'carol': {'timestamp': 1000, 'checksum': 'sum'}}}))
+    state = st.load_state(str(file))
+    assert state == {'decks': {}}
+
+def test_failed_lookups_are_synced_again(tmp_path):
+    state = st.load_state(str(tmp_path / 'state.json'))
+    deck = k.deck_id(BOOK, ENGLISH, 'A')
+    # lookups at 400 and 700 failed: the deck is synced up to just before the earliest of them
+    records = [{'word': 'a', 'title': 'a', 'timestamp': 300}, {'word': 'b', 'title': None, 'timestamp': 700},
+               {'word': 'c', 'title': None, 'timestamp': 400}, {'word': 'd', 'title': 'd', 'timestamp': 900}]
+    failed = []
+    assert list(k.note_failures(records, failed)) == records
+    st.mark(state, deck, BOOK, 'sum', min(failed))
+    assert st.since(state, deck, 'sum') == 399      # retried even though vocab.db is unchanged
+    st.mark(state, deck, BOOK, 'sum')
+    assert st.since(state, deck, 'sum') is False
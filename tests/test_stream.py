@@ -0,0 +1,150 @@
+# tests of the streaming lookups (kindle2anki.stream_definitions) with a fake fetch and parser
+#
+import multiprocessing
+import os
+
+import pytest
+
+import kindle2anki as k
+
+ENGLISH = {'src_lang': 'en', 'id': 1, 'url': 'https://www.merriam-webster.com/dictionary/'}
+FRENCH = {'src_lang': 'fr', 'id': 1, 'url': 'https://www.larousse.fr/dictionnaires/francais/'}
+LEMMAS = {'mangeait': 'manger'}     # Larousse redirects these to the entry of their lemma
+
+@pytest.fixture
+def fetched(monkeypatch):
+    monkeypatch.setattr(k, 'parse_response', lambda parser, text, word: 'definition of ' + text)
+    return []
+
+def fake_fetch(dict, fetched):
+    def fetch(word):
+        fetched.append(word)
+        if word in LEMMAS:
+            return f"{dict['url']}{LEMMAS[word]}/1234", LEMMAS[word]
+        return dict['url'] + word, word
+    return fetch
+
+def stream(dict, words, fetched, **kwargs):
+    records = [{'word': word, 'stem': stem} for word, stem in words]
+    return [(r['word'], r['title'], r['definition']) for r in k.stream_definitions(dict, records, fake_fetch(dict, fetched), **kwargs)]
+
+def test_titles_of_shared_lookups(fetched):
+    words = [('Running', 'run'), ('runs', 'run'), ('House', None), ('house', None)]
+    assert stream(ENGLISH, words, fetched, workers=2) == [
+        ('Running', 'run', 'definition of run'), ('runs', 'run', 'definition of run'),
+        ('House', 'House', 'definition of House'), ('house', 'house', 'definition of House')]
+    assert sorted(fetched) == ['House', 'run']
+
+def test_title_of_redirected_lookup(fetched):
+    assert stream(FRENCH, [('mangeait', None), ('maison', None)], fetched) == [
+        ('mangeait', 'manger', 'definition of manger'), ('maison', 'maison', 'definition of maison')]
+
+def test_title_of_inflected_word(fetched):
+    # looked up as the stem Kindle recorded, the page is the stem's entry (no redirect) and titles the card
+    assert stream(FRENCH, [('navigué', 'naviguer'), ('Naviguer', 'naviguer'), ('Maison', 'maison')], fetched, workers=3) == [
+        ('navigué', 'naviguer', 'definition of naviguer'), ('Naviguer', 'Naviguer', 'definition of naviguer'),
+        ('Maison', 'Maison', 'definition of maison')]
+    assert fetched == ['naviguer', 'maison']
+
+def test_results_kept_while_in_flight_only(fetched, tmp_path):
+    import k2a_cache as c
+    words = [('run', 'run'), ('walk', None), ('talk', None), ('runs', 'run')]
+    # one word in flight at a time: the group of 'run' is resolved before 'runs' comes in
+    assert [title for _, title, _ in stream(ENGLISH, words, fetched, workers=1)] == ['run', 'walk', 'talk', 'run']
+    assert fetched == ['run', 'walk', 'talk', 'run']
+    fetched.clear()
+    cache = c.DefinitionCache(str(tmp_path / 'cache.db'))
+    assert stream(ENGLISH, words, fetched, cache=cache, workers=1)[3] == ('runs', 'run', 'definition of run')
+    assert fetched == ['run', 'walk', 'talk']
+    cache.close()
+
+def crashing_parse(parser, text, word): # parses as the fake parser, but a parse process given 'crash' dies
+    if text == 'crash' and multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return 'definition of ' + text
+
+def test_parse_process_dies(monkeypatch, capsys):
+    monkeypatch.setattr(k, 'parse_response', crashing_parse)
+    words = ['apple', 'crash', 'pear', 'plum', 'fig', 'kiwi']
+    records = [{'word': word, 'stem': None} for word in words]
+    fetch = lambda word: (ENGLISH['url'] + word, word)
+    result = [(r['word'], r['definition']) for r in k.stream_definitions(ENGLISH, records, fetch, workers=2, parsers=1)]
+    # every word is parsed: those in flight when the process died and all later ones in the fetching threads
+    assert result == [(word, 'definition of ' + word) for word in words]
+    assert 'a parse process died' in capsys.readouterr().out
+
+class Response:
+    def __init__(self, status_code, url):
+        self.status_code = status_code
+        self.url = url
+        self.reason = 'reason'
+        self.headers = {'Content-Type': 'text/html; charset=utf-8'}
+        self.content = url.rsplit('/', 1)[1].encode()
+        self.text = self.content.decode()
+
+class Session: # answers with the status given for a word, 200 for others
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def get(self, url, timeout=None):
+        return Response(self.statuses.get(url.rsplit('/', 1)[1], 200), url)
+
+def test_only_pages_cached_as_misses(monkeypatch, tmp_path):
+    import k2a_cache as c
+    import k2a_throttle as t
+    monkeypatch.setattr(t, 'COOLDOWN', 0.0)
+    # the parser finds no entry in any page
+    monkeypatch.setattr(k, 'parse_response', lambda parser, text, word: 'None')
+    cache = c.DefinitionCache(str(tmp_path / 'cache.db'))
+    fetch = k.make_fetch(Session({'gone': 404, 'broken': 500}), ENGLISH, 'ERROR', cache=cache, rate=1000)
+    records = [{'word': word, 'stem': None} for word in ['gone', 'broken', 'blank']]
+    assert [r['title'] for r in k.stream_definitions(ENGLISH, records, fetch, cache=cache)] == [None, None, 'blank']
+    assert [cache.is_miss(ENGLISH, word) for word in ['gone', 'broken', 'blank']] == [False, False, True]
+    cache.close()
+
+def test_known_miss_is_not_a_failure(fetched, tmp_path):
+    import k2a_cache as c
+    cache = c.DefinitionCache(str(tmp_path / 'cache.db'))
+    cache.put_miss(ENGLISH, 'xyzzy')
+    # a word known not to be in the dictionary is titled, only failed lookups are not (see note_failures)
+    assert stream(ENGLISH, [('xyzzy', None)], fetched, cache=cache) == [('xyzzy', 'xyzzy', 'None')]
+    assert fetched == []
+    cache.close()
+
+def dictionary(id, known): # a fake dictionary knowing some words, with a fetch function recording its lookups
+    dict = {'src_lang': 'en', 'id': id, 'url': f'https://dict{id}.example/', 'name': f'dict{id}', 'desc': ' desc '}
+    fetched = []
+    def fetch(word):
+        fetched.append(word)
+        return dict['url'] + word, f"{dict['name']}:{word}" if word in known else 'nothing'
+    return dict, fetch, fetched
+
+def chain(dicts, words, merge):
+    records = [{'word': word, 'stem': None} for word in words]
+    return [(r['word'], r['source']['name'], r['definition'])
+            for r in k.stream_chain([d for d, _, _ in dicts], records, [f for _, f, _ in dicts], workers=2, merge=merge)]
+
+@pytest.fixture
+def chained(monkeypatch):
+    monkeypatch.setattr(k, 'parse_response', lambda parser, text, word: 'None' if text == 'nothing' else text)
+
+def test_chain_falls_back_on_misses(chained):
+    first, second = dictionary(1, {'cat', 'dog'}), dictionary(2, {'cat', 'emu'})
+    assert chain([first, second], ['cat', 'emu', 'dog', 'gnu'], merge=False) == [
+        ('cat', 'dict1', 'dict1:cat'), ('emu', 'dict2', 'dict2:emu'), ('dog', 'dict1', 'dict1:dog'), ('gnu', 'dict2', 'None')]
+    # only the words the first dictionary lacks are looked up in the second
+    assert sorted(first[2]) == ['cat', 'dog', 'emu', 'gnu'] and sorted(second[2]) == ['emu', 'gnu']
+
+def test_chain_merges_in_order(chained):
+    dicts = [dictionary(1, {'cat'}), dictionary(2, {'cat', 'emu'}), dictionary(3, {'emu', 'cat'})]
+    assert chain(dicts, ['cat', 'emu', 'gnu'], merge=True) == [
+        ('cat', 'dict1', 'dict1 (desc):\ndict1:cat\n\ndict2 (desc):\ndict2:cat\n\ndict3 (desc):\ndict3:cat'),
+        ('emu', 'dict2', 'dict2 (desc):\ndict2:emu\n\ndict3 (desc):\ndict3:emu'),
+        ('gnu', 'dict3', 'None')]
+
+def test_shelved_words_are_looked_up_again(chained):
+    # set aside by shelve, words found (or not) in one dictionary are looked up in the next one all the same
+    first, second = dictionary(1, {'cat'}), dictionary(2, {'emu'})
+    assert chain([first, second], ['cat', 'emu'], merge=True) == [
+        ('cat', 'dict1', 'dict1 (desc):\ndict1:cat'), ('emu', 'dict2', 'dict2 (desc):\ndict2:emu')]
+    assert sorted(first[2]) == ['cat', 'emu'] and sorted(second[2]) == ['cat', 'emu']
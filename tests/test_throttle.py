@@ -0,0 +1,76 @@
+# tests of the adaptive throttling of the requests to a dictionary host (k2a_throttle)
+#
+from urllib.error import HTTPError
+import pytest
+import kindle2anki as k
+import k2a_throttle as t
+
+def test_retry_after():
+    assert t.retry_after(None) is None
+    assert t.retry_after('2') == 2.0
+    assert t.retry_after('-1') == 0.0
+    assert t.retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert t.retry_after('soon') is None
+
+def test_overload_slows_down_first():
+    throttle = t.HostThrottle('host', rate=64)
+    # the host signals overload: the rate is halved, the request keeps its attempts
+    assert throttle.failure(sent=throttle.acquire()) == (0.0, False, False)
+    assert throttle.rate == 32
+    throttle.rate = throttle.min_rate
+    # at the lowest rate overload counts as a failed attempt
+    assert throttle.failure(sent=throttle.acquire()) == (0.0, False, True)
+
+def test_circuit_opens_after_repeated_failures():
+    throttle = t.HostThrottle('host', rate=1000)
+    sent = [throttle.acquire() for _ in range(t.FAILURES + 1)]
+    for attempt in sent[:t.FAILURES - 1]:
+        assert throttle.failure(throttled=False, sent=attempt) == (0.0, False, True)
+    # the failure opening the circuit and those of requests sent before do not use up attempts
+    pause, opened, counted = throttle.failure(throttled=False, sent=sent[-2])
+    assert (pause, opened, counted) == (t.COOLDOWN, True, False)
+    pause, opened, counted = throttle.failure(throttled=False, sent=sent[-1])
+    assert (opened, counted) == (False, False) and 0 < pause <= t.COOLDOWN
+    assert throttle.cooldown == 2 * t.COOLDOWN
+
+def test_success_recovers():
+    throttle = t.HostThrottle('host', rate=50)
+    throttle.failure(sent=throttle.acquire())
+    throttle.success()
+    assert throttle.rate == 26
+    assert throttle.failures == 0
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.reason = 'reason'
+        self.headers = {}
+
+class Session: # answers the requests with the given statuses, the last one repeated
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.requested = 0
+
+    def get(self, url, timeout=None):
+        self.requested += 1
+        return Response(self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0])
+
+def test_server_error_is_retried():
+    session = Session(500, 502, 200)
+    assert k.throttled_get(session, 'http://erring.example/word', 1, 1000).status_code == 200
+    assert session.requested == 3
+    assert k.host_throttle('http://erring.example/').failures == 0
+
+def test_refusing_host_fails(monkeypatch):
+    monkeypatch.setattr(t, 'COOLDOWN', 0.0)
+    session = Session(403)
+    with pytest.raises(HTTPError) as err:
+        k.throttled_get(session, 'http://refusing.example/word', 1, 1000)
+    assert err.value.code == 403
+    # the refusals open the circuit like other failures, the attempts are used up
+    assert session.requested > t.MAX_ATTEMPTS
+
+def test_client_error_is_returned():
+    session = Session(404)
+    assert k.throttled_get(session, 'http://missing.example/word', 1, 1000).status_code == 404
+    assert session.requested == 1